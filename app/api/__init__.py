@@ -4,9 +4,14 @@ API PACKAGE INITIALIZATION
 ================================================================================
 
 PURPOSE:
-    This file makes the app/api/ directory a Python package and exports
+    This file makes the app/api/ directory a Python package and lists
     all API router modules.
 
+    Routers are NOT imported here. main.py imports each one explicitly
+    when registering it, so importing a single router module does not
+    drag in every other router (and the Gemini / Firestore service graph
+    behind them).
+
 ROUTERS:
     auth      - Authentication (login, register, token verification)
     users     - User profile management
@@ -17,6 +22,4 @@ ROUTERS:
 ================================================================================
 """
 
-from app.api import auth, users, sessions, functions, chat
-
 __all__ = ["auth", "users", "sessions", "functions", "chat"]
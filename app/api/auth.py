@@ -4,7 +4,7 @@ Handles user registration and login with Google OAuth.
 """
 from fastapi import APIRouter, HTTPException, status, Request
 from typing import Dict
-from fastapi.responses import JSONResponse
+from fastapi.responses import ORJSONResponse
 import httpx
 
 from app.models import UserRegistration, LoginRequest, TokenResponse
@@ -172,4 +172,4 @@ async def google_auth_callback(request: Request):
     id_token = token_data.get("id_token")
 
     # Optional: Return tokens or redirect the user to another page
-    return JSONResponse(content={"access_token": access_token, "id_token": id_token, "message": "OAuth2 callback handled successfully"})
+    return ORJSONResponse(content={"access_token": access_token, "id_token": id_token, "message": "OAuth2 callback handled successfully"})
@@ -4,27 +4,42 @@ CHAT API ENDPOINTS FOR EVA
 ================================================================================
 """
 
-from fastapi import APIRouter, Depends, HTTPException, status, Header
-from fastapi.responses import StreamingResponse
-from pydantic import BaseModel, Field
-from typing import Optional, List, Dict, Any
-from datetime import datetime
-import uuid
-import json
+from fastapi import APIRouter, Depends, HTTPException, status, BackgroundTasks, Path, Query
+from fastapi.responses import StreamingResponse, ORJSONResponse
+from pydantic import BaseModel, ConfigDict, Field
+from typing import Optional, List, Dict, Any, AsyncIterator
+from datetime import datetime, timedelta, timezone
+import asyncio
+import secrets
+import orjson
+from ulid import ULID
 
 from app.services.gemini_service import gemini_service
 from app.services.firestore_service import firestore_service
-from app.services.auth_service import auth_service
 from app.models import User
+from app.utils.dependencies import get_current_user
 
 
 # ================================================================================
 # REQUEST/RESPONSE MODELS
 # ================================================================================
 
+# Conversation IDs as minted by _short_id("conv"). Messages are stored
+# under the doc-ID prefix "{user_id}_{conversation_id}_" and read by key
+# range, so an arbitrary ID (e.g. "conv") could match the prefix of every
+# conversation: anything else is rejected before reaching Firestore.
+CONVERSATION_ID_PATTERN = r"^conv_[0-9a-f]{12}$"
+
+# Shared config for inbound request bodies: reject unknown fields and
+# trim surrounding whitespace during validation
+REQUEST_MODEL_CONFIG = ConfigDict(extra="forbid", str_strip_whitespace=True)
+
+
 class ChatMessageRequest(BaseModel):
+    model_config = REQUEST_MODEL_CONFIG
+
     message: str = Field(..., min_length=1, max_length=10000)
-    conversation_id: Optional[str] = None
+    conversation_id: Optional[str] = Field(None, pattern=CONVERSATION_ID_PATTERN)
 
 
 class ChatMessageResponse(BaseModel):
@@ -44,6 +59,8 @@ class ConversationInfo(BaseModel):
 
 
 class NewConversationRequest(BaseModel):
+    model_config = REQUEST_MODEL_CONFIG
+
     title: Optional[str] = Field(None, max_length=100)
 
 
@@ -54,36 +71,85 @@ class NewConversationResponse(BaseModel):
 
 
 # ================================================================================
-# AUTHENTICATION HELPER (FIXED)
+# STREAMING SETTINGS
 # ================================================================================
 
-async def get_current_user(authorization: Optional[str] = Header(None)) -> User:
+# A buffered SSE frame is sent once it reaches this many characters,
+# ends a sentence/line, or has waited SSE_FLUSH_INTERVAL seconds for more
+# text, instead of one frame per Gemini chunk.
+SSE_FLUSH_CHARS = 32
+SSE_FLUSH_ENDINGS = (".", "!", "?", "\n")
+SSE_FLUSH_INTERVAL = 0.05
+
+
+# ================================================================================
+# ID HELPERS
+# ================================================================================
+
+def _short_id(prefix: str) -> str:
+    """Return a short random ID like 'conv_1a2b3c4d5e6f' (12 hex chars)."""
+    return f"{prefix}_{secrets.token_hex(6)}"
+
+
+def _message_id(timestamp: datetime) -> str:
     """
-    Validate the JWT token from the Header and return the current user.
+    Return a time-sortable message ID like 'msg_01HV3K...' (a ULID).
+
+    The high bits encode the timestamp, so message documents sort in
+    chronological order by ID while the random low bits spread writes.
     """
-    if not authorization or not authorization.startswith("Bearer "):
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Missing or invalid authorization header"
-        )
-    
-    token = authorization.replace("Bearer ", "")
-    payload = auth_service.decode_access_token(token)
-    
-    if not payload:
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Invalid or expired token"
-        )
-    
-    user = await firestore_service.get_user(payload.get("sub"))
-    if not user:
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="User not found"
-        )
-    
-    return user
+    return f"msg_{ULID.from_datetime(timestamp)}"
+
+
+def _reply_timestamp(user_timestamp: datetime, response_timestamp: datetime) -> datetime:
+    """
+    Timestamp for a reply, at least 1 ms after the message it answers.
+
+    ULIDs only encode milliseconds and the rest is random, so a reply
+    stamped in the same millisecond as its prompt (e.g. a cached answer)
+    could otherwise sort before it by ID.
+    """
+    return max(response_timestamp, user_timestamp + timedelta(milliseconds=1))
+
+
+async def _coalesce_chunks(stream: AsyncIterator[str]) -> AsyncIterator[str]:
+    """
+    Regroup streamed text into SSE-sized pieces (see SSE_FLUSH_*).
+
+    The next chunk is awaited as a task, so a partial buffer is flushed
+    on time even while the model is slow to send more.
+    """
+    loop = asyncio.get_running_loop()
+    iterator = stream.__aiter__()
+    buffer = ""
+    deadline = 0.0
+    next_chunk = asyncio.ensure_future(iterator.__anext__())
+    try:
+        while True:
+            timeout = max(0.0, deadline - loop.time()) if buffer else None
+            done, _ = await asyncio.wait((next_chunk,), timeout=timeout)
+            if not done:
+                yield buffer
+                buffer = ""
+                continue
+            try:
+                chunk = next_chunk.result()
+            except StopAsyncIteration:
+                break
+            next_chunk = asyncio.ensure_future(iterator.__anext__())
+
+            if not buffer:
+                deadline = loop.time() + SSE_FLUSH_INTERVAL
+            buffer += chunk
+            if len(buffer) >= SSE_FLUSH_CHARS or buffer.endswith(SSE_FLUSH_ENDINGS):
+                yield buffer
+                buffer = ""
+        if buffer:
+            yield buffer
+    finally:
+        # Client went away mid-stream: stop pulling from the model
+        if not next_chunk.done():
+            next_chunk.cancel()
 
 
 # ================================================================================
@@ -93,6 +159,7 @@ async def get_current_user(authorization: Optional[str] = Header(None)) -> User:
 router = APIRouter(
     prefix="/chat",
     tags=["Chat"],
+    default_response_class=ORJSONResponse,
     responses={401: {"description": "Not authenticated"}}
 )
 
@@ -101,7 +168,7 @@ router = APIRouter(
 # ENDPOINTS (REFACTORED)
 # ================================================================================
 
-@router.post("/send", response_model=ChatMessageResponse)
+@router.post("/send", response_model=ChatMessageResponse, response_model_exclude_none=True)
 async def send_message(
     request: ChatMessageRequest,
     user: User = Depends(get_current_user)
@@ -109,44 +176,31 @@ async def send_message(
     """Send a message to EVA and get a response."""
     
     # Generate IDs
-    message_id = f"msg_{uuid.uuid4().hex[:12]}"
-    conversation_id = request.conversation_id or f"conv_{uuid.uuid4().hex[:12]}"
-    
-    # Save user's message
-    await firestore_service.save_chat_message(
-        user_id=user.uid,
-        conversation_id=conversation_id,
-        message_id=message_id,
-        content=request.message,
-        role="user",
-        timestamp=datetime.utcnow()
-    )
+    user_timestamp = datetime.now(timezone.utc)
+    message_id = _message_id(user_timestamp)
+    conversation_id = request.conversation_id or _short_id("conv")
     
     # Get response from Gemini
     response_text = await gemini_service.send_message(
         message=request.message,
-        user_id=user.uid,
-        conversation_id=conversation_id
-    )
-    
-    # Save EVA's response
-    response_id = f"msg_{uuid.uuid4().hex[:12]}"
-    response_timestamp = datetime.utcnow()
-    
-    await firestore_service.save_chat_message(
         user_id=user.uid,
         conversation_id=conversation_id,
-        message_id=response_id,
-        content=response_text,
-        role="assistant",
-        timestamp=response_timestamp
+        new_conversation=not request.conversation_id
     )
     
-    # Update metadata
-    await firestore_service.update_conversation_metadata(
+    # Save both messages and update metadata in one commit
+    response_timestamp = _reply_timestamp(user_timestamp, datetime.now(timezone.utc))
+    response_id = _message_id(response_timestamp)
+    
+    await firestore_service.save_turn(
         user_id=user.uid,
         conversation_id=conversation_id,
-        last_message=response_text[:50]
+        messages=[
+            {"message_id": message_id, "content": request.message, "role": "user", "timestamp": user_timestamp},
+            {"message_id": response_id, "content": response_text, "role": "assistant", "timestamp": response_timestamp},
+        ],
+        last_message=response_text[:50],
+        new_conversation=not request.conversation_id
     )
     
     return ChatMessageResponse(
@@ -160,67 +214,84 @@ async def send_message(
 @router.post("/send/stream")
 async def send_message_stream(
     request: ChatMessageRequest,
+    background_tasks: BackgroundTasks,
     user: User = Depends(get_current_user)
 ):
     """Send a message and stream EVA's response in real-time."""
     
-    conversation_id = request.conversation_id or f"conv_{uuid.uuid4().hex[:12]}"
-    await firestore_service.save_chat_message(
-        user_id=user.uid,
-        conversation_id=conversation_id,
-        message_id=f"msg_{uuid.uuid4().hex[:12]}",
-        content=request.message,
-        role="user",
-        timestamp=datetime.utcnow()
-    )
+    conversation_id = request.conversation_id or _short_id("conv")
+    user_timestamp = datetime.now(timezone.utc)
+    user_message_id = _message_id(user_timestamp)
+    chunks: List[str] = []
     
     async def generate():
-        full_response = ""
-        async for chunk in gemini_service.send_message_stream(
+        # Coalesce small chunks into fewer frames (size, sentence end or time)
+        async for text in _coalesce_chunks(gemini_service.send_message_stream(
             message=request.message,
             user_id=user.uid,
-            conversation_id=conversation_id
-        ):
-            full_response += chunk
-            yield f"data: {json.dumps({'text': chunk, 'done': False})}\n\n"
-        
-        yield f"data: {json.dumps({'text': '', 'done': True})}\n\n"
-        
-        await firestore_service.save_chat_message(
+            conversation_id=conversation_id,
+            new_conversation=not request.conversation_id
+        )):
+            chunks.append(text)
+            yield b"data: " + orjson.dumps({"text": text, "done": False}) + b"\n\n"
+        yield b"data: " + orjson.dumps({"text": "", "done": True}) + b"\n\n"
+    
+    async def persist_turn():
+        # Runs after the last SSE frame is sent, off the response path
+        full_response = "".join(chunks)
+        response_timestamp = _reply_timestamp(user_timestamp, datetime.now(timezone.utc))
+        await firestore_service.save_turn(
             user_id=user.uid,
             conversation_id=conversation_id,
-            message_id=f"msg_{uuid.uuid4().hex[:12]}",
-            content=full_response,
-            role="assistant",
-            timestamp=datetime.utcnow()
+            messages=[
+                {"message_id": user_message_id, "content": request.message, "role": "user", "timestamp": user_timestamp},
+                {"message_id": _message_id(response_timestamp), "content": full_response, "role": "assistant", "timestamp": response_timestamp},
+            ],
+            last_message=full_response[:50],
+            new_conversation=not request.conversation_id
         )
     
-    return StreamingResponse(generate(), media_type="text/event-stream")
+    background_tasks.add_task(persist_turn)
+    return StreamingResponse(generate(), media_type="text/event-stream", background=background_tasks)
 
 
 @router.get("/history/{conversation_id}")
 async def get_chat_history(
-    conversation_id: str,
-    limit: int = 50,
+    conversation_id: str = Path(..., pattern=CONVERSATION_ID_PATTERN),
+    limit: int = Query(50, ge=1, le=200),
+    cursor: Optional[str] = None,
     user: User = Depends(get_current_user)
-) -> List[Dict[str, Any]]:
-    return await firestore_service.get_chat_messages(
-        user_id=user.uid,
-        conversation_id=conversation_id,
-        limit=limit
-    )
+) -> Dict[str, Any]:
+    """
+    Get one page of messages plus the conversation's metadata.
+
+    Pass next_cursor back as cursor for the next page.
+    """
+    try:
+        return await firestore_service.get_conversation_bundle(
+            user_id=user.uid,
+            conversation_id=conversation_id,
+            limit=limit,
+            cursor=cursor
+        )
+    except ValueError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
 
 
 @router.post("/new", response_model=NewConversationResponse)
 async def new_conversation(
+    background_tasks: BackgroundTasks,
     request: NewConversationRequest = None,
     user: User = Depends(get_current_user)
 ) -> NewConversationResponse:
-    conversation_id = f"conv_{uuid.uuid4().hex[:12]}"
-    timestamp = datetime.utcnow()
+    conversation_id = _short_id("conv")
+    timestamp = datetime.now(timezone.utc)
     title = request.title if request and request.title else "New Conversation"
     
-    gemini_service.clear_conversation(user.uid, conversation_id)
+    background_tasks.add_task(gemini_service.clear_conversation, user.uid, conversation_id)
     await firestore_service.create_conversation(
         user_id=user.uid,
         conversation_id=conversation_id,
@@ -235,15 +306,37 @@ async def new_conversation(
     )
 
 
-@router.get("/conversations", response_model=List[ConversationInfo])
-async def list_conversations(user: User = Depends(get_current_user)) -> List[ConversationInfo]:
-    conversations = await firestore_service.get_user_conversations(user.uid)
+@router.get("/conversations", response_model=List[ConversationInfo], response_model_exclude_none=True)
+async def list_conversations(
+    limit: Optional[int] = Query(None, ge=1, le=200),
+    cursor: Optional[str] = None,
+    user: User = Depends(get_current_user)
+) -> List[ConversationInfo]:
+    """
+    List conversations, newest first.
+
+    Without `limit` every conversation is returned. To page, pass `limit`
+    and then the last item's `updated_at` and `conversation_id`, joined
+    by a comma, as `cursor` for the next page.
+    """
+    try:
+        conversations = await firestore_service.get_user_conversations(
+            user.uid, limit=limit, cursor=cursor
+        )
+    except ValueError:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid cursor"
+        )
+    # Firestore data was written by us, so skip per-item validation
     return [
-        ConversationInfo(
+        ConversationInfo.model_construct(
             conversation_id=conv["conversation_id"],
             title=conv.get("title", "Untitled"),
-            created_at=conv["created_at"],
-            updated_at=conv.get("updated_at", conv["created_at"]),
+            # created_at is only missing for conversations whose ID the
+            # client made up without calling /new
+            created_at=conv.get("created_at", conv["updated_at"]),
+            updated_at=conv["updated_at"],
             message_count=conv.get("message_count", 0)
         )
         for conv in conversations
@@ -252,9 +345,10 @@ async def list_conversations(user: User = Depends(get_current_user)) -> List[Con
 
 @router.delete("/{conversation_id}")
 async def delete_conversation(
-    conversation_id: str,
+    background_tasks: BackgroundTasks,
+    conversation_id: str = Path(..., pattern=CONVERSATION_ID_PATTERN),
     user: User = Depends(get_current_user)
 ) -> Dict[str, str]:
     await firestore_service.delete_conversation(user.uid, conversation_id)
-    gemini_service.clear_conversation(user.uid, conversation_id)
+    background_tasks.add_task(gemini_service.clear_conversation, user.uid, conversation_id)
     return {"message": f"Conversation {conversation_id} deleted successfully"}
@@ -2,7 +2,7 @@
 Function calling API routes.
 Enables dynamic function execution framework.
 """
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, status, Request, Response
 from typing import Dict, Any, List
 
 from app.models import User, FunctionCall, FunctionResponse
@@ -13,8 +13,25 @@ from app.services.firestore_service import firestore_service
 # API Router for Functions
 router = APIRouter(prefix="/functions", tags=["Functions"])
 
+def _etag_matches(if_none_match: str, etag: str) -> bool:
+    """
+    Whether an If-None-Match header matches `etag`.
+
+    The header may list several tags separated by commas, or be "*";
+    comparison is weak, so a "W/" prefix on either side is ignored.
+    """
+    opaque = etag.removeprefix("W/")
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate == "*" or candidate.removeprefix("W/") == opaque:
+            return True
+    return False
+
 @router.get("/", response_model=Dict[str, Dict[str, Any]])
-async def list_functions(current_user: User = Depends(get_current_user)) -> Dict[str, Dict[str, Any]]:
+async def list_functions(
+    request: Request,
+    current_user: User = Depends(get_current_user)
+) -> Response:
     """
     List all available functions.
     
@@ -25,13 +42,23 @@ async def list_functions(current_user: User = Depends(get_current_user)) -> Dict
     
     This allows clients to discover what functions they can call.
     
+    The listing only changes on deploy, so the response carries an ETag
+    and clients sending a matching If-None-Match get a 304 with no body.
+    
     Args:
+        request: Incoming request (for the If-None-Match header)
         current_user: Authenticated user from dependency
         
     Returns:
         Dictionary of function names to metadata
     """
-    return function_registry.list_functions()
+    body, etag = function_registry.list_functions_json()
+    headers = {"ETag": etag, "Cache-Control": "private, max-age=60"}
+    
+    if _etag_matches(request.headers.get("if-none-match", ""), etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    
+    return Response(content=body, media_type="application/json", headers=headers)
 
 @router.post("/gemini-api", response_model=FunctionResponse)
 async def gemini_api_dynamic_function(
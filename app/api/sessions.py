@@ -7,7 +7,11 @@ from typing import List, Dict, Any
 
 from app.models import User, SessionData
 from app.utils.dependencies import get_current_user, generate_session_id
-from app.services.firestore_service import firestore_service
+from app.services.firestore_service import (
+    firestore_service,
+    SessionNotFoundError,
+    SessionAccessDeniedError,
+)
 
 
 router = APIRouter(prefix="/sessions", tags=["Sessions"])
@@ -127,30 +131,22 @@ async def update_session(
     Raises:
         HTTPException: 404 if session not found or 403 if not owned by user
     """
-    # Verify session exists and belongs to user
-    session = await firestore_service.get_session(session_id)
-    
-    if not session:
+    # Ownership check and update run in one Firestore transaction
+    try:
+        updated_session = await firestore_service.update_session_if_owner(
+            session_id, current_user.uid, data
+        )
+    except SessionNotFoundError:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Session not found"
         )
-    
-    if session.user_id != current_user.uid:
+    except SessionAccessDeniedError:
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="Not authorized to update this session"
         )
     
-    # Update session
-    updated_session = await firestore_service.update_session(session_id, data)
-    
-    if not updated_session:
-        raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail="Failed to update session"
-        )
-    
     return updated_session
 
 
@@ -172,28 +168,18 @@ async def delete_session(
     Raises:
         HTTPException: 404 if session not found or 403 if not owned by user
     """
-    # Verify session exists and belongs to user
-    session = await firestore_service.get_session(session_id)
-    
-    if not session:
+    # Ownership check and delete run in one Firestore transaction
+    try:
+        await firestore_service.delete_session_if_owner(session_id, current_user.uid)
+    except SessionNotFoundError:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Session not found"
         )
-    
-    if session.user_id != current_user.uid:
+    except SessionAccessDeniedError:
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="Not authorized to delete this session"
         )
     
-    # Delete session
-    success = await firestore_service.delete_session(session_id)
-    
-    if not success:
-        raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail="Failed to delete session"
-        )
-    
     return {"message": "Session deleted successfully"}
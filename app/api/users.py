@@ -5,7 +5,7 @@ Handles user profile operations.
 from fastapi import APIRouter, Depends, HTTPException, status
 from typing import List, Dict, Any
 
-from app.models import User
+from app.models import User, UserSyncRequest
 from app.utils.dependencies import get_current_user
 from app.services.firestore_service import firestore_service
 
@@ -58,7 +58,11 @@ async def add_device(device_id: str, current_user: User = Depends(get_current_us
     Returns:
         Success message
     """
-    await firestore_service.add_device_to_user(current_user.uid, device_id)
+    if not await firestore_service.add_device_to_user(current_user.uid, device_id):
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="User not found"
+        )
     return {"message": f"Device {device_id} added successfully"}
 
 
@@ -83,7 +87,11 @@ async def update_preferences(
     Returns:
         Success message
     """
-    await firestore_service.update_user(current_user.uid, {"preferences": preferences})
+    if not await firestore_service.update_user(current_user.uid, {"preferences": preferences}):
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="User not found"
+        )
     return {"message": "Preferences updated successfully"}
 
 
@@ -99,3 +107,37 @@ async def get_preferences(current_user: User = Depends(get_current_user)) -> Dic
         User preferences dictionary
     """
     return current_user.preferences
+
+
+@router.post("/me/sync")
+async def sync_user(
+    sync: UserSyncRequest,
+    current_user: User = Depends(get_current_user)
+) -> Dict[str, str]:
+    """
+    Add devices and update preferences in a single request.
+    
+    All changes are committed to Firestore as one batch instead of one
+    round trip per device / preference update.
+    
+    Args:
+        sync: Devices to add and optional new preferences
+        current_user: Authenticated user from dependency
+        
+    Returns:
+        Success message
+    """
+    updates = []
+    if sync.preferences is not None:
+        updates.append(("preferences", sync.preferences))
+    
+    if not await firestore_service.batch_update_user(
+        current_user.uid,
+        updates,
+        add_devices=sync.devices
+    ):
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="User not found"
+        )
+    return {"message": "User synced successfully"}
@@ -7,6 +7,7 @@ UPDATED CONFIGURATION MANAGEMENT FOR EVA BACKEND
 from pydantic_settings import BaseSettings, SettingsConfigDict
 from pydantic import Field
 from typing import List
+from functools import cached_property, lru_cache
 import os
 
 class Settings(BaseSettings):
@@ -32,9 +33,42 @@ class Settings(BaseSettings):
     
     api_secret_key: str = Field(default="762c83f5332d4cb184812a4ec3e2dc9efe8f5d1b6fde73e5f8b03c7d4a114e96")
 
+    # Uvicorn worker processes and max concurrent connections per worker
+    api_workers: int = Field(default=1)
+    api_limit_concurrency: int = Field(default=1000)
+
     # ===== USER MANAGEMENT =====
     max_users: int = Field(default=5)
 
+    # ===== AUTH CACHE =====
+    # Seconds a resolved bearer token is reused without re-verifying it.
+    # Set AUTH_CACHE_TTL=0 to disable the cache entirely.
+    auth_cache_ttl: float = Field(default=5.0)
+    auth_cache_size: int = Field(default=10_000)
+
+    # ===== USER CACHE =====
+    # Seconds a Firestore user document is served from process memory.
+    # Set USER_CACHE_TTL=0 to always read through to Firestore.
+    user_cache_ttl: float = Field(default=60.0)
+    user_cache_size: int = Field(default=1_000)
+    # Seconds the registered-user count (checked against MAX_USERS) is reused
+    user_count_cache_ttl: float = Field(default=60.0)
+
+    # ===== SESSION CACHE =====
+    # Seconds a session document is served from process memory. Kept short:
+    # sessions sync devices, and other instances only see writes on expiry.
+    # Set SESSION_CACHE_TTL=0 to always read through to Firestore.
+    session_cache_ttl: float = Field(default=10.0)
+    session_cache_size: int = Field(default=10_000)
+
+    # ===== REDIS (OPTIONAL) =====
+    # Shared cache across instances; leave REDIS_URL empty to disable.
+    redis_url: str = Field(default="")
+    redis_user_ttl: int = Field(default=300)
+    # Seconds a user write blocks Redis refills, so a read that started
+    # before the write cannot cache the old document (see invalidate_user)
+    redis_user_tombstone_ttl: int = Field(default=30)
+
     # ===== CORS CONFIGURATION =====
     cors_origins: str = Field(default="http://localhost:3000,http://localhost:8080")
 
@@ -42,13 +76,14 @@ class Settings(BaseSettings):
     environment: str = Field(default="production")
 
     # ===== COMPUTED PROPERTIES =====
-    @property
+    # Cached: settings never change after startup, so parse them once
+    @cached_property
     def cors_origins_list(self) -> List[str]:
         if not self.cors_origins:
             return []
         return [origin.strip() for origin in self.cors_origins.split(",")]
     
-    @property
+    @cached_property
     def is_production(self) -> bool:
         return self.environment.lower() == "production"
 
@@ -60,5 +95,16 @@ class Settings(BaseSettings):
         extra="ignore" # This prevents crashes if extra variables are found
     )
 
+@lru_cache(maxsize=1)
+def get_settings() -> Settings:
+    """
+    Return the process-wide Settings, reading the environment and .env once.
+
+    Routes can take it as a dependency (Depends(get_settings)), which also
+    lets tests swap it via app.dependency_overrides.
+    """
+    return Settings()
+
+
 # Create singleton settings instance
-settings = Settings()
+settings = get_settings()
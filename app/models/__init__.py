@@ -2,12 +2,17 @@
 Data models for Eva backend.
 Defines the structure of User, Session, and other core entities.
 """
-from pydantic import BaseModel, EmailStr, Field
+from pydantic import BaseModel, ConfigDict, Field
 from typing import Optional, Dict, Any, List
-from datetime import datetime
+from datetime import datetime, timezone
 from enum import Enum
 
 
+def _utcnow() -> datetime:
+    """Timezone-aware UTC now (datetime.utcnow is naive and deprecated)."""
+    return datetime.now(timezone.utc)
+
+
 class UserRole(str, Enum):
     """User roles in the system."""
     USER = "user"
@@ -29,10 +34,13 @@ class User(BaseModel):
         preferences: User preferences and settings
     """
     uid: str
-    email: EmailStr
+    # Plain str: this model is rebuilt from Firestore/cache on every
+    # authenticated request, and the address was validated at ingress
+    # (see AuthService.register_user), so re-running email validation here is wasted work.
+    email: str
     display_name: Optional[str] = None
     role: UserRole = UserRole.USER
-    created_at: datetime = Field(default_factory=datetime.utcnow)
+    created_at: datetime = Field(default_factory=_utcnow)
     last_login: Optional[datetime] = None
     devices: List[str] = Field(default_factory=list)
     preferences: Dict[str, Any] = Field(default_factory=dict)
@@ -67,8 +75,8 @@ class SessionData(BaseModel):
     user_id: str
     device_id: str
     data: Dict[str, Any] = Field(default_factory=dict)
-    created_at: datetime = Field(default_factory=datetime.utcnow)
-    updated_at: datetime = Field(default_factory=datetime.utcnow)
+    created_at: datetime = Field(default_factory=_utcnow)
+    updated_at: datetime = Field(default_factory=_utcnow)
     expires_at: Optional[datetime] = None
 
 
@@ -83,11 +91,14 @@ class FunctionCall(BaseModel):
         device_id: Device making the request
         timestamp: Call timestamp
     """
+    # Built server-side per call and never mutated afterwards
+    model_config = ConfigDict(frozen=True, extra="forbid")
+
     function_name: str
     parameters: Dict[str, Any] = Field(default_factory=dict)
     user_id: str
     device_id: Optional[str] = None
-    timestamp: datetime = Field(default_factory=datetime.utcnow)
+    timestamp: datetime = Field(default_factory=_utcnow)
 
 
 class FunctionResponse(BaseModel):
@@ -100,12 +111,29 @@ class FunctionResponse(BaseModel):
         error: Error message if failed
         execution_time: Time taken to execute (seconds)
     """
+    model_config = ConfigDict(frozen=True, extra="forbid")
+
     success: bool
     result: Optional[Dict[str, Any]] = None
     error: Optional[str] = None
     execution_time: Optional[float] = None
 
 
+class UserSyncRequest(BaseModel):
+    """
+    Model for batched user sync requests.
+    
+    Lets a client push new devices and preferences in one call, which
+    is written to Firestore as a single batch.
+    
+    Attributes:
+        devices: Device IDs to add to the user's device list
+        preferences: Replacement preferences dictionary (optional)
+    """
+    devices: List[str] = Field(default_factory=list)
+    preferences: Optional[Dict[str, Any]] = None
+
+
 class UserRegistration(BaseModel):
     """Model for user registration requests."""
     id_token: str  # Google ID token from OAuth
@@ -0,0 +1,94 @@
+"""
+================================================================================
+BEARER TOKEN CACHE
+================================================================================
+
+PURPOSE:
+    Remembers which uid a bearer token was verified for, for a few
+    seconds, so bursts of requests from the same client skip the JWT
+    signature check. Only the uid is cached: the User itself is still
+    loaded through the user cache, which every user write invalidates,
+    so profile/device/preference changes are visible immediately.
+
+HOW IT WORKS:
+    - Keys are SHA-256 digests of the raw token (the token itself is never
+      stored in memory as a dict key)
+    - Each entry stores (uid, expires_at); expires_at is the earlier of
+      the cache TTL and the token's own "exp" claim, so a cached entry can
+      never outlive the token it came from
+    - The cache is bounded (LRU eviction on top of the TTL)
+
+CONFIGURATION:
+    AUTH_CACHE_TTL  - Seconds to keep an entry (default 5, 0 disables)
+    AUTH_CACHE_SIZE - Maximum number of cached tokens (default 10000)
+
+================================================================================
+"""
+
+import asyncio
+import hashlib
+import time
+from typing import Optional, Tuple
+
+from cachetools import TTLCache
+
+from app.config import settings
+
+
+class AuthCache:
+    """
+    Bounded TTL+LRU cache mapping bearer tokens to verified uids.
+    """
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.ttl = ttl
+        self.enabled = ttl > 0 and maxsize > 0
+        self._cache: TTLCache = TTLCache(maxsize=max(maxsize, 1), ttl=max(ttl, 0.001))
+        self._lock = asyncio.Lock()
+
+    @staticmethod
+    def _key(token: str) -> bytes:
+        return hashlib.sha256(token.encode()).digest()
+
+    async def get(self, token: str) -> Optional[str]:
+        """Return the cached uid for a token, or None on miss / expiry."""
+        if not self.enabled:
+            return None
+
+        key = self._key(token)
+        async with self._lock:
+            entry: Optional[Tuple[str, float]] = self._cache.get(key)
+            if entry is None:
+                return None
+
+            user_id, expires_at = entry
+            if expires_at <= time.time():
+                # Token expired before the TTL did — drop it now
+                self._cache.pop(key, None)
+                return None
+
+            return user_id
+
+    async def set(self, token: str, user_id: str, token_exp: Optional[float]) -> None:
+        """Cache a verified uid until min(token exp, now + ttl)."""
+        if not self.enabled:
+            return
+
+        expires_at = time.time() + self.ttl
+        if token_exp is not None:
+            expires_at = min(expires_at, float(token_exp))
+
+        async with self._lock:
+            self._cache[self._key(token)] = (user_id, expires_at)
+
+    async def clear(self) -> None:
+        """Drop every cached entry."""
+        async with self._lock:
+            self._cache.clear()
+
+
+# Process-wide instance used by AuthService.resolve_user_from_bearer
+auth_cache = AuthCache(
+    maxsize=settings.auth_cache_size,
+    ttl=settings.auth_cache_ttl,
+)
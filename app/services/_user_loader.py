@@ -0,0 +1,80 @@
+"""
+================================================================================
+BATCHING USER LOADER
+================================================================================
+
+PURPOSE:
+    DataLoader-style coalescing for user lookups. Every uid requested
+    during the same event-loop tick is collected and fetched with one
+    firestore_service.get_users() call (a single get_all() round trip for
+    whatever is not already cached), instead of one read per caller.
+
+HOW IT WORKS:
+    - load(uid) registers a future for the uid and, for the first uid of a
+      batch, schedules a flush with loop.call_soon()
+    - Concurrent loads of the same uid share one future (single-flight),
+      including while its batch is already being fetched
+    - The flush resolves every future with its User (or None), or with the
+      exception if the fetch failed
+
+================================================================================
+"""
+
+import asyncio
+from typing import Dict, List, Optional
+
+from app.models import User
+from app.services.firestore_service import firestore_service
+
+
+class UserLoader:
+    """
+    Coalesces concurrent get_user calls into batched Firestore reads.
+    """
+
+    def __init__(self):
+        # Unresolved futures by uid (queued or being fetched)
+        self._pending: Dict[str, "asyncio.Future[Optional[User]]"] = {}
+        # uids waiting for the next flush
+        self._queue: List[str] = []
+        # Keeps running flush tasks referenced until they finish
+        self._tasks: set = set()
+
+    async def load(self, user_id: str) -> Optional[User]:
+        """Return the user for a uid, batched with other loads this tick."""
+        future = self._pending.get(user_id)
+        if future is None:
+            loop = asyncio.get_running_loop()
+            future = loop.create_future()
+            self._pending[user_id] = future
+            if not self._queue:
+                loop.call_soon(self._start_flush)
+            self._queue.append(user_id)
+
+        # shield: one cancelled request must not cancel the shared result
+        return await asyncio.shield(future)
+
+    def _start_flush(self) -> None:
+        user_ids, self._queue = self._queue, []
+        task = asyncio.ensure_future(self._flush(user_ids))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _flush(self, user_ids: List[str]) -> None:
+        try:
+            users = await firestore_service.get_users(user_ids)
+        except Exception as e:
+            for user_id in user_ids:
+                future = self._pending.pop(user_id)
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for user_id in user_ids:
+            future = self._pending.pop(user_id)
+            if not future.done():
+                future.set_result(users.get(user_id))
+
+
+# Singleton instance
+user_loader = UserLoader()
@@ -31,12 +31,35 @@ SECURITY LAYERS:
 from google.oauth2 import id_token
 from google.auth.transport import requests
 from jose import JWTError, jwt
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 from typing import Optional, Tuple
+import asyncio
+import base64
+import hashlib
+import hmac
+import time
+
+import orjson
 
 from app.config import settings
 from app.models import User, UserRole
 from app.services.firestore_service import firestore_service
+from app.services._auth_cache import auth_cache
+from app.services._user_loader import user_loader
+
+
+# One transport Request for all Google ID token checks. Its underlying
+# requests.Session keeps the TLS connection to Google's cert endpoint
+# alive, instead of opening a fresh session for every login.
+_google_request = requests.Request()
+
+
+def _b64url(raw: bytes) -> bytes:
+    return base64.urlsafe_b64encode(raw).rstrip(b"=")
+
+
+# Every access token has the same HS256 header, so encode it once
+_JWT_HEADER_B64 = _b64url(orjson.dumps({"alg": "HS256", "typ": "JWT"}))
 
 
 class AuthService:
@@ -63,6 +86,7 @@ class AuthService:
         """
         self.google_client_id = settings.google_client_id
         self.secret_key = settings.api_secret_key
+        self._secret_key_bytes = self.secret_key.encode("utf-8")
 
         # ---- Startup validation ------------------------------------------------
         # Fail fast if critical auth config is missing. This surfaces
@@ -101,9 +125,12 @@ class AuthService:
             None if the token is invalid or was not issued for our client ID
         """
         try:
-            idinfo = id_token.verify_oauth2_token(
+            # Blocking network fetch + RSA verify — run it in the thread
+            # pool so concurrent logins don't stall the event loop
+            idinfo = await asyncio.to_thread(
+                id_token.verify_oauth2_token,
                 id_token_string,
-                requests.Request(),
+                _google_request,
                 self.google_client_id,
             )
 
@@ -142,14 +169,20 @@ class AuthService:
         """
         to_encode = data.copy()
 
-        expire = datetime.utcnow() + (
-            expires_delta
+        # JWT "exp" is just a Unix timestamp — no datetime objects needed
+        lifetime = (
+            expires_delta.total_seconds()
             if expires_delta
-            else timedelta(minutes=self.ACCESS_TOKEN_EXPIRE_MINUTES)
+            else self.ACCESS_TOKEN_EXPIRE_MINUTES * 60
         )
-        to_encode.update({"exp": expire})
+        to_encode["exp"] = int(time.time() + lifetime)
 
-        return jwt.encode(to_encode, self.secret_key, algorithm=self.ALGORITHM)
+        # Sign HS256 directly: precomputed header + orjson payload + HMAC.
+        # Same compact JWS that jose.jwt.encode produces, at a fraction of
+        # the cost; verification below still goes through python-jose.
+        signing_input = _JWT_HEADER_B64 + b"." + _b64url(orjson.dumps(to_encode))
+        signature = hmac.new(self._secret_key_bytes, signing_input, hashlib.sha256).digest()
+        return (signing_input + b"." + _b64url(signature)).decode("ascii")
 
     def decode_access_token(self, token: str) -> Optional[dict]:
         """
@@ -179,7 +212,7 @@ class AuthService:
         Register a new user with a Google ID token.
 
         Flow:
-            1. Verify the Google token → proves identity
+            1. Verify the Google token and its email → proves identity
             2. Check the user doesn't already exist → prevents duplicates
             3. Enforce user limit → personal-project guardrail
             4. Create user in Firestore
@@ -200,13 +233,29 @@ class AuthService:
         if not google_user:
             raise ValueError("Invalid Google ID token")
 
+        # Validate the email here, once, at ingress and before any Firestore
+        # read. email_validator is imported lazily so it only loads on the
+        # (rare) registration path, not at startup. EmailNotValidError
+        # subclasses ValueError; a missing claim is rejected up front since
+        # validate_email(None) would raise TypeError instead.
+        from email_validator import validate_email
+
+        raw_email = google_user.get("email")
+        if not isinstance(raw_email, str) or not raw_email:
+            raise ValueError("Google account has no email")
+        email = validate_email(raw_email, check_deliverability=False).normalized
+
+        # Existence check and user count are independent — run them together
+        existing_user, user_count = await asyncio.gather(
+            firestore_service.get_user(google_user["sub"], source="server"),
+            firestore_service.count_users(),
+        )
+
         # Check if user already exists
-        existing_user = await firestore_service.get_user(google_user["sub"])
         if existing_user:
             raise ValueError("User already registered")
 
         # Check user limit
-        user_count = await firestore_service.count_users()
         if user_count >= settings.max_users:
             raise ValueError(
                 f"Maximum user limit ({settings.max_users}) reached"
@@ -215,11 +264,11 @@ class AuthService:
         # Create new user
         user = User(
             uid=google_user["sub"],
-            email=google_user["email"],
+            email=email,
             display_name=google_user.get("name"),
             role=UserRole.USER,
-            created_at=datetime.utcnow(),
-            last_login=datetime.utcnow(),
+            created_at=datetime.now(timezone.utc),
+            last_login=datetime.now(timezone.utc),
             devices=[device_id] if device_id else [],
         )
 
@@ -248,9 +297,9 @@ class AuthService:
         Flow:
             1. Verify the Google token
             2. Look up the user in Firestore
-            3. Update last-login timestamp
-            4. Register device if new
-            5. Issue a fresh JWT access token
+            3. Update last-login timestamp and register device if new
+               (single batched Firestore commit)
+            4. Issue a fresh JWT access token
 
         Args:
             id_token_string: Google ID token from the Android app
@@ -267,20 +316,19 @@ class AuthService:
         if not google_user:
             raise ValueError("Invalid Google ID token")
 
-        # Get user from Firestore
-        user = await firestore_service.get_user(google_user["sub"])
+        # Get user from Firestore (not the cache — login is rare and should
+        # see the current document; this also refreshes the cached copy)
+        user = await firestore_service.get_user(google_user["sub"], source="server")
         if not user:
             raise ValueError("User not found. Please register first.")
 
-        # Update last login
-        await firestore_service.update_user(
-            user.uid, {"last_login": datetime.utcnow()}
+        # Update last login and register the device in one commit
+        await firestore_service.batch_update_user(
+            user.uid,
+            [("last_login", datetime.now(timezone.utc))],
+            add_devices=[device_id] if device_id else None,
         )
 
-        # Add device if provided and not already registered
-        if device_id:
-            await firestore_service.add_device_to_user(user.uid, device_id)
-
         # Generate access token
         access_token = self.create_access_token(
             {"sub": user.uid, "email": user.email}
@@ -292,18 +340,27 @@ class AuthService:
     # TOKEN → USER LOOKUP
     # ===========================================================================
 
-    async def get_current_user(self, token: str) -> Optional[User]:
+    async def resolve_user_from_bearer(self, token: str) -> Optional[User]:
         """
-        Resolve a JWT access token to a User object.
+        Resolve a bearer JWT to a User — the single token → user path.
 
-        Used by the /auth/verify endpoint and internal helpers.
+        The short-lived token cache maps a token to the uid it was verified
+        for (never beyond the token's own expiry), so a hit skips the JWT
+        check. The User is always loaded through user_loader (batched with
+        concurrent lookups, served from the user cache), never cached per
+        token: user writes invalidate the user cache, so they are visible
+        on the very next request. Every auth dependency goes through here.
 
         Args:
             token: JWT access token
 
         Returns:
-            User object, or None if token is invalid
+            User object, or None if the token is invalid or the user is gone
         """
+        user_id = await auth_cache.get(token)
+        if user_id is not None:
+            return await user_loader.load(user_id)
+
         payload = self.decode_access_token(token)
         if not payload:
             return None
@@ -312,7 +369,24 @@ class AuthService:
         if not user_id:
             return None
 
-        return await firestore_service.get_user(user_id)
+        user = await user_loader.load(user_id)
+        if user:
+            await auth_cache.set(token, user_id, payload.get("exp"))
+        return user
+
+    async def get_current_user(self, token: str) -> Optional[User]:
+        """
+        Resolve a JWT access token to a User object.
+
+        Used by the /auth/verify endpoint and internal helpers.
+
+        Args:
+            token: JWT access token
+
+        Returns:
+            User object, or None if token is invalid
+        """
+        return await self.resolve_user_from_bearer(token)
 
 
 # Global singleton — used by all API routes
@@ -1,50 +1,437 @@
 from google.cloud import firestore
-from datetime import datetime
-from typing import Optional, List, Dict, Any
+from google.api_core import retry_async
+from google.api_core.exceptions import (
+    Aborted, DeadlineExceeded, InternalServerError, InvalidArgument, NotFound,
+    ServiceUnavailable,
+)
+import asyncio
+import logging
+import time
+import orjson
+from cachetools import TTLCache
+from ulid import ULID
+from datetime import datetime, timezone
+from typing import Optional, List, Dict, Any, Tuple, AsyncIterator
 from app.config import settings
+from app.services.redis_service import redis_service
+
+__all__ = [
+    "FirestoreService",
+    "SessionNotFoundError",
+    "SessionAccessDeniedError",
+    "firestore_service",
+]
+
+logger = logging.getLogger(__name__)
+
+
+class SessionNotFoundError(LookupError):
+    """Raised when a session document does not exist."""
+
+
+class SessionAccessDeniedError(PermissionError):
+    """Raised when a session belongs to a different user."""
+
+
+def _load_credentials():
+    """
+    Service-account credentials from GOOGLE_APPLICATION_CREDENTIALS, loaded
+    once and passed to the client explicitly (this also honours a path set
+    only in .env). Returns None to use Application Default Credentials,
+    e.g. the Cloud Run service identity.
+    """
+    if not settings.google_application_credentials:
+        return None
+    from google.oauth2 import service_account
+    return service_account.Credentials.from_service_account_file(
+        settings.google_application_credentials
+    )
+
+
+# Bounded exponential backoff for transient gRPC failures on writes.
+# DEADLINE_EXCEEDED is ambiguous (the write may have landed), so it is only
+# retried for idempotent writes; commits carrying Increment use
+# _COMMIT_RETRY so a retry can never double-count a message.
+_WRITE_RETRY = retry_async.AsyncRetry(
+    predicate=retry_async.if_exception_type(ServiceUnavailable, Aborted, DeadlineExceeded),
+    initial=0.1, maximum=2.0, multiplier=2.0, timeout=10.0,
+)
+_COMMIT_RETRY = retry_async.AsyncRetry(
+    predicate=retry_async.if_exception_type(ServiceUnavailable, Aborted),
+    initial=0.1, maximum=2.0, multiplier=2.0, timeout=10.0,
+)
+# Deletes are idempotent, so they can also retry INTERNAL (500) errors
+_DELETE_RETRY = retry_async.AsyncRetry(
+    predicate=retry_async.if_exception_type(
+        ServiceUnavailable, Aborted, DeadlineExceeded, InternalServerError,
+    ),
+    initial=0.1, maximum=2.0, multiplier=2.0, timeout=30.0,
+)
+_WRITE_TIMEOUT = 5.0
+
+
+# Chat writes are buffered and committed together: at most every
+# WRITE_BUFFER_INTERVAL seconds, or sooner once WRITE_BUFFER_MAX_OPS
+# writes are waiting (Firestore caps a commit at 500). Callers wait for
+# their own group's commit, so nothing is acknowledged before it lands.
+WRITE_BUFFER_INTERVAL = 0.05
+WRITE_BUFFER_MAX_OPS = 400
+
+# Conversations with more messages than this are deleted by scanning
+# DELETE_PARTITIONS message-ID ranges in parallel instead of one cursor.
+PARTITIONED_DELETE_THRESHOLD = 1000
+DELETE_PARTITIONS = 8
+# Conversation deletes commit DELETE_BATCH_SIZE deletes per batch, with at
+# most DELETE_MAX_COMMITS batches in flight; the scan waits for a free slot.
+DELETE_BATCH_SIZE = 250
+DELETE_MAX_COMMITS = 15
+
+
+# Redis value left by invalidate_user; reads treat it as a miss
+_USER_TOMBSTONE = b"-"
+
+
+# Client-supplied function parameters/results are stored as-is only when
+# Firestore can hold them; see _firestore_safe.
+_MAX_MAP_DEPTH = 16
+_INT64_MIN, _INT64_MAX = -(2 ** 63), 2 ** 63 - 1
+
+
+def _firestore_safe(value: Any, in_array: bool = False, depth: int = 0) -> Any:
+    """
+    Coerce arbitrary JSON-ish data into something Firestore will accept.
+
+    Arrays directly inside arrays and maps nested deeper than
+    _MAX_MAP_DEPTH are stored as their JSON text; ints outside int64 and
+    unknown types become strings.
+    """
+    if value is None or isinstance(value, (bool, float, str, bytes, datetime)):
+        return value
+    if isinstance(value, int):
+        return value if _INT64_MIN <= value <= _INT64_MAX else str(value)
+    if isinstance(value, dict):
+        if depth >= _MAX_MAP_DEPTH:
+            return orjson.dumps(value, default=str, option=orjson.OPT_NON_STR_KEYS).decode()
+        return {str(k): _firestore_safe(v, depth=depth + 1) for k, v in value.items()}
+    if isinstance(value, (list, tuple, set)):
+        if in_array:
+            return orjson.dumps(list(value), default=str, option=orjson.OPT_NON_STR_KEYS).decode()
+        return [_firestore_safe(v, in_array=True, depth=depth) for v in value]
+    return str(value)
+
 
 class FirestoreService:
     """
     Service class for interacting with Google Cloud Firestore.
     Handles storage and retrieval of chat history and user data.
+
+    One Firestore client (and therefore one gRPC channel pool) is shared
+    by the whole process through the `firestore_service` singleton below.
+    Do not construct additional clients elsewhere.
     """
 
     def __init__(self):
         self.db = None
+        # Read-through cache for user documents (uid -> User).
+        # Seeded on create; entries are dropped on every other user write.
+        # The generation counts those drops, so a read that overlapped one
+        # does not cache what it read (see _cache_user).
+        self._user_generation = 0
+        self._user_cache: TTLCache = TTLCache(
+            maxsize=settings.user_cache_size,
+            ttl=settings.user_cache_ttl,
+        )
+        # Read-through cache for session documents (session_id -> SessionData),
+        # refreshed by this process's session writes
+        self._session_cache: TTLCache = TTLCache(
+            maxsize=settings.session_cache_size,
+            ttl=settings.session_cache_ttl,
+        )
+        # In-flight session reads (single-flight): concurrent misses for the
+        # same session share one Firestore read
+        self._session_inflight: Dict[str, "asyncio.Task[Optional[Any]]"] = {}
+        # Write buffer for chat writes. Each item is one group of
+        # (doc_ref, data, merge) writes that must land in the same commit,
+        # plus the future its caller awaits. The queue and flusher are
+        # created inside the running loop on first use (see _enqueue_writes).
+        self._write_queue: "Optional[asyncio.Queue[Tuple[List[Tuple[Any, Dict[str, Any], bool]], asyncio.Future]]]" = None
+        self._write_loop: Optional[asyncio.AbstractEventLoop] = None
+        self._flusher: Optional[asyncio.Task] = None
+        # Function-log writes in flight. Kept out of the chat write buffer:
+        # their payloads are client-shaped and must not sink a shared commit.
+        self._log_tasks: set = set()
+        # (count, time.monotonic() when counted) from the last users
+        # aggregation; the lock lets one caller refresh it at a time
+        self._user_count_cache: Optional[Tuple[int, float]] = None
+        self._user_count_lock = asyncio.Lock()
 
     def _initialize(self):
         if self.db is None:
-            # Connect to your "default" database
-            self.db = firestore.Client(
+            # Connect to your "default" database. AsyncClient, so every
+            # read/write awaits the network instead of blocking the loop.
+            self.db = firestore.AsyncClient(
                 project=settings.google_cloud_project,
+                credentials=_load_credentials(),
                 database="default"
             )
+            # Collection refs are immutable; build them once, not per call
+            self._users_col = self.db.collection("users")
+            self._conv_col = self.db.collection("conversations")
+            self._chat_col = self.db.collection("chat_messages")
+            self._sessions_col = self.db.collection("sessions")
+            self._function_calls_col = self.db.collection("function_calls")
+
+    async def warmup(self) -> None:
+        """
+        Create the client and complete one tiny read so the gRPC channel
+        and auth token are ready before the first user request arrives.
+        """
+        self._initialize()
+        await self._users_col.limit(1).get()
+
+    # ================================================================================
+    # WRITE BUFFER
+    # ================================================================================
+
+    async def _enqueue_writes(self, writes: List[Tuple[Any, Dict[str, Any], bool]]) -> None:
+        """
+        Queue a group of writes for the flusher and wait for its commit.
+
+        Raises whatever error made the group's commit fail.
+        """
+        loop = asyncio.get_running_loop()
+        if self._write_loop is not loop:
+            # First use, or a new event loop (tests, reloads): a queue or
+            # flusher from another loop cannot be used here
+            self._write_queue = asyncio.Queue()
+            self._flusher = None
+            self._write_loop = loop
+        future = loop.create_future()
+        self._write_queue.put_nowait((writes, future))
+        if self._flusher is None or self._flusher.done():
+            self._flusher = asyncio.create_task(self._flush_forever())
+        # Shielded: a caller that goes away must not cancel the future the
+        # flusher is about to resolve
+        await asyncio.shield(future)
+
+    async def _flush_forever(self) -> None:
+        while True:
+            groups = [await self._write_queue.get()]
+            # Give concurrent requests a moment to add their writes
+            await asyncio.sleep(WRITE_BUFFER_INTERVAL)
+            ops = len(groups[0][0])
+            while ops < WRITE_BUFFER_MAX_OPS and not self._write_queue.empty():
+                group = self._write_queue.get_nowait()
+                groups.append(group)
+                ops += len(group[0])
+            await self._commit_groups(groups)
+
+    async def _commit_batch(self, groups: List[List[Tuple[Any, Dict[str, Any], bool]]]) -> None:
+        # Building the batch encodes every value, so an unencodable one
+        # raises here (TypeError) rather than at commit
+        batch = self.db.batch()
+        for writes in groups:
+            for doc_ref, data, merge in writes:
+                batch.set(doc_ref, data, merge=merge)
+        await batch.commit(retry=_COMMIT_RETRY, timeout=_WRITE_TIMEOUT)
+
+    async def _commit_groups(self, groups: List[Tuple[List[Tuple[Any, Dict[str, Any], bool]], asyncio.Future]]) -> None:
+        """Commit queued groups and resolve each caller's future with the outcome."""
+        writes = [group for group, _ in groups]
+        try:
+            try:
+                await self._commit_batch(writes)
+                results: List[Any] = [None] * len(groups)
+            except (TypeError, ValueError, InvalidArgument) as e:
+                # A rejected payload: commit each group on its own so only
+                # the offending group fails. Not done for other errors —
+                # after e.g. DEADLINE_EXCEEDED the batch may have landed, and
+                # a second commit would double-apply its Increments.
+                if len(groups) == 1:
+                    results = [e]
+                else:
+                    results = await asyncio.gather(
+                        *(self._commit_batch([group]) for group in writes),
+                        return_exceptions=True,
+                    )
+            except Exception as e:
+                results = [e] * len(groups)
+
+            failed = [r for r in results if isinstance(r, Exception)]
+            if failed:
+                logger.error("Dropped %d of %d buffered write group(s): %s", len(failed), len(groups), failed[0])
+            for (_, future), result in zip(groups, results):
+                if future.done():
+                    continue
+                if isinstance(result, Exception):
+                    future.set_exception(result)
+                else:
+                    future.set_result(None)
+        finally:
+            for _, future in groups:
+                # Only reachable if the flusher itself was cancelled mid-commit
+                if not future.done():
+                    future.set_exception(RuntimeError("Write buffer stopped before the commit finished"))
+                self._write_queue.task_done()
+
+    async def flush(self) -> None:
+        """Wait until every buffered write is committed (call on shutdown)."""
+        if self._log_tasks:
+            await asyncio.gather(*self._log_tasks, return_exceptions=True)
+        if self._flusher is None or self._flusher.done():
+            return
+        await self._write_queue.join()
+        self._flusher.cancel()
+        self._flusher = None
 
     # ================================================================================
     # CHAT MESSAGE OPERATIONS
     # ================================================================================
 
-    async def save_chat_message(self, user_id: str, conversation_id: str, message_id: str, content: str, role: str, timestamp: datetime) -> None:
-        self._initialize()
-        doc_id = f"{user_id}_{conversation_id}_{message_id}"
-        doc_ref = self.db.collection("chat_messages").document(doc_id)
-        doc_ref.set({
+    def _chat_message_ref(self, user_id: str, conversation_id: str, message_id: str):
+        return self._chat_col.document(f"{user_id}_{conversation_id}_{message_id}")
+
+    @staticmethod
+    def _chat_message_payload(content: str, role: str, timestamp: datetime) -> Dict[str, Any]:
+        # user_id, conversation_id and message_id are all in the doc ID,
+        # so they are not stored (or indexed) again as fields
+        return {"content": content, "role": role, "timestamp": timestamp}
+
+    @staticmethod
+    def _chat_message_from_doc(user_id: str, conversation_id: str, doc) -> Dict[str, Any]:
+        """Message dict for API responses, with the ID fields restored."""
+        prefix_len = len(user_id) + len(conversation_id) + 2
+        return {
             "user_id": user_id,
             "conversation_id": conversation_id,
-            "message_id": message_id,
-            "content": content,
-            "role": role,
-            "timestamp": timestamp.isoformat()
-        })
+            "message_id": doc.id[prefix_len:],
+            **doc.to_dict(),
+        }
+
+    def _chat_messages_query(self, user_id: str, conversation_id: str):
+        """
+        Every message of one conversation, in document-ID order.
+
+        Message doc IDs all start with "{user_id}_{conversation_id}_", so the
+        conversation is one contiguous key range: no equality filters and no
+        composite index, just a bounded scan over the built-in __name__ index.
+        """
+        prefix = f"{user_id}_{conversation_id}_"
+        return self._chat_messages_range(prefix, prefix + "\uf8ff")
 
-    async def get_chat_messages(self, user_id: str, conversation_id: str, limit: int = 50) -> List[Dict[str, Any]]:
+    def _chat_messages_range(self, start_id: str, end_id: str, descending: bool = False):
+        """Messages with start_id <= doc ID < end_id, in document-ID order."""
+        collection = self._chat_col
+        direction = firestore.Query.DESCENDING if descending else firestore.Query.ASCENDING
+        return (collection
+                .where("__name__", ">=", collection.document(start_id))
+                .where("__name__", "<", collection.document(end_id))
+                .order_by("__name__", direction=direction))
+
+    async def save_chat_message(self, user_id: str, conversation_id: str, message_id: str, content: str, role: str, timestamp: datetime) -> None:
         self._initialize()
-        query = (self.db.collection("chat_messages")
-                 .where("user_id", "==", user_id)
-                 .where("conversation_id", "==", conversation_id)
-                 .order_by("timestamp").limit(limit))
-        docs = query.stream()
-        return [doc.to_dict() for doc in docs]
+        doc_ref = self._chat_message_ref(user_id, conversation_id, message_id)
+        await self._enqueue_writes([(doc_ref, self._chat_message_payload(content, role, timestamp), False)])
+
+    async def save_turn(self, user_id: str, conversation_id: str, messages: List[Dict[str, Any]], last_message: str, new_conversation: bool = False) -> None:
+        """
+        Save one chat turn through the write buffer.
+
+        Writes every message in `messages` (dicts with message_id, content,
+        role, timestamp) and bumps the conversation metadata. Pass
+        new_conversation=True when the caller just minted the conversation
+        ID, so the title and created_at are written with it. The turn is
+        committed atomically, batched with other concurrent turns, and this
+        returns only once that commit has succeeded (it raises otherwise).
+        """
+        self._initialize()
+        writes = []
+
+        for message in messages:
+            doc_ref = self._chat_message_ref(user_id, conversation_id, message["message_id"])
+            writes.append((doc_ref, self._chat_message_payload(
+                message["content"], message["role"], message["timestamp"]
+            ), False))
+
+        conv_ref = self._conv_col.document(f"{user_id}_{conversation_id}")
+        metadata = self._conversation_metadata(user_id, conversation_id, last_message)
+        if new_conversation:
+            # A new conversation is created at its first message
+            metadata["title"] = last_message[:30]
+            metadata["created_at"] = messages[0]["timestamp"]
+        writes.append((conv_ref, metadata, True))
+
+        await self._enqueue_writes(writes)
+
+    async def get_chat_messages(self, user_id: str, conversation_id: str, limit: int = 50, cursor: Optional[str] = None) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        """
+        Fetch one page of a conversation's messages in chronological order.
+
+        Message IDs are ULIDs, so ordering by document ID is chronological
+        and no separate timestamp sort (or composite index on it) is needed;
+        the page is read as a key-range scan (see _chat_messages_query).
+
+        Args:
+            cursor: message_id of the last message from the previous page
+
+        Returns:
+            Tuple of (messages, next_cursor); next_cursor is None on the last page
+
+        Raises:
+            ValueError: If the cursor is not a valid message ID
+        """
+        self._initialize()
+        query = self._chat_messages_query(user_id, conversation_id).limit(limit)
+        if cursor:
+            if "/" in cursor:
+                raise ValueError("Invalid cursor")
+            # The sort key is the document ID itself, so resume from the
+            # key directly instead of reading the cursor document first
+            query = query.start_after({"__name__": self._chat_message_ref(user_id, conversation_id, cursor)})
+        messages = [self._chat_message_from_doc(user_id, conversation_id, doc) async for doc in query.stream()]
+        next_cursor = messages[-1]["message_id"] if len(messages) == limit else None
+        return messages, next_cursor
+
+    async def get_recent_chat_messages(self, user_id: str, conversation_id: str, limit: int) -> List[Dict[str, Any]]:
+        """
+        The last `limit` messages of a conversation (role and content only),
+        oldest first. Reads the key range backwards, so it costs `limit`
+        reads however long the conversation is.
+        """
+        self._initialize()
+        prefix = f"{user_id}_{conversation_id}_"
+        query = (self._chat_messages_range(prefix, prefix + "\uf8ff", descending=True)
+                 .select(["role", "content"])
+                 .limit(limit))
+        messages = [doc.to_dict() async for doc in query.stream()]
+        messages.reverse()
+        return messages
+
+    async def get_conversation_bundle(self, user_id: str, conversation_id: str, limit: int = 50, cursor: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Fetch a page of messages and the conversation document together.
+
+        Both reads are issued concurrently, so the pair costs one round
+        trip of wall-clock time instead of two.
+
+        Returns:
+            Dict with "messages", "next_cursor" and "conversation" (the
+            conversation metadata, or None if the document does not exist)
+
+        Raises:
+            ValueError: If the cursor is not a valid message ID
+        """
+        self._initialize()
+        conv_ref = self._conv_col.document(f"{user_id}_{conversation_id}")
+        (messages, next_cursor), conv_doc = await asyncio.gather(
+            self.get_chat_messages(user_id, conversation_id, limit=limit, cursor=cursor),
+            conv_ref.get(),
+        )
+        return {
+            "messages": messages,
+            "next_cursor": next_cursor,
+            "conversation": conv_doc.to_dict() if conv_doc.exists else None,
+        }
 
     # ================================================================================
     # CONVERSATION OPERATIONS
@@ -53,122 +440,620 @@ class FirestoreService:
     async def create_conversation(self, user_id: str, conversation_id: str, title: str, created_at: datetime) -> None:
         self._initialize()
         doc_id = f"{user_id}_{conversation_id}"
-        doc_ref = self.db.collection("conversations").document(doc_id)
-        doc_ref.set({
+        doc_ref = self._conv_col.document(doc_id)
+        await doc_ref.set({
             "user_id": user_id,
             "conversation_id": conversation_id,
             "title": title,
-            "created_at": created_at.isoformat(),
-            "updated_at": created_at.isoformat(),
+            "created_at": created_at,
+            "updated_at": created_at,
             "message_count": 0
-        })
+        }, retry=_WRITE_RETRY, timeout=_WRITE_TIMEOUT)
 
-    async def update_conversation_metadata(self, user_id: str, conversation_id: str, last_message: str) -> None:
-        self._initialize()
-        doc_id = f"{user_id}_{conversation_id}"
-        doc_ref = self.db.collection("conversations").document(doc_id)
-        if not doc_ref.get().exists:
-            await self.create_conversation(user_id, conversation_id, last_message[:30], datetime.utcnow())
-        doc_ref.update({
-            "updated_at": datetime.utcnow().isoformat(),
+    @staticmethod
+    def _conversation_metadata(user_id: str, conversation_id: str, last_message: str) -> Dict[str, Any]:
+        """
+        Build the merge payload that records a new message on a conversation.
+
+        Never reads the document: the owner fields are idempotent and always
+        sent (so a conversation is listable even if /new was skipped),
+        updated_at is the server's commit time, and the title is only set
+        where the conversation is created.
+        """
+        return {
+            "user_id": user_id,
+            "conversation_id": conversation_id,
+            "updated_at": firestore.SERVER_TIMESTAMP,
             "message_count": firestore.Increment(1),
             "last_message": last_message
-        })
+        }
+
+    async def update_conversation_metadata(self, user_id: str, conversation_id: str, last_message: str) -> None:
+        self._initialize()
+        doc_ref = self._conv_col.document(f"{user_id}_{conversation_id}")
+        # One merge write, no read
+        await doc_ref.set(self._conversation_metadata(user_id, conversation_id, last_message), merge=True, retry=_COMMIT_RETRY, timeout=_WRITE_TIMEOUT)
+
+    async def get_user_conversations(self, user_id: str, limit: Optional[int] = None, cursor: Optional[str] = None) -> List[Dict[str, Any]]:
+        """
+        List a user's conversations, most recently updated first.
+
+        Returns only conversation_id, title, created_at, updated_at and
+        message_count for each conversation. Ties on updated_at are broken
+        by document ID, so the order is total and no page boundary can
+        skip a conversation.
 
-    async def get_user_conversations(self, user_id: str) -> List[Dict[str, Any]]:
+        Args:
+            limit: Page size; None returns every conversation
+            cursor: "{updated_at},{conversation_id}" of the last conversation
+                on the previous page (updated_at as ISO 8601). The query
+                resumes after it with a Firestore cursor, so a page costs
+                `limit` reads however deep it is. A conversation updated
+                while paging moves above the cursor, to the first page.
+
+        Raises:
+            ValueError: If cursor is malformed
+        """
         self._initialize()
-        query = (self.db.collection("conversations")
+        # Project only the sidebar fields; last_message and friends stay
+        # on the server. __name__ follows updated_at's direction, so the
+        # (user_id, updated_at DESC) composite index still serves this.
+        query = (self._conv_col
                  .where("user_id", "==", user_id)
-                 .order_by("updated_at", direction=firestore.Query.DESCENDING))
-        docs = query.stream()
+                 .order_by("updated_at", direction=firestore.Query.DESCENDING)
+                 .order_by("__name__", direction=firestore.Query.DESCENDING)
+                 .select(["conversation_id", "title", "created_at", "updated_at", "message_count"]))
+        if cursor:
+            cursor_ts, sep, cursor_id = cursor.rpartition(",")
+            if not sep or not cursor_id:
+                raise ValueError(f"Invalid cursor: {cursor}")
+            # Responses serialize UTC as "...Z", which fromisoformat only
+            # accepts from Python 3.11
+            query = query.start_after({
+                "updated_at": datetime.fromisoformat(cursor_ts.replace("Z", "+00:00")),
+                "__name__": f"{user_id}_{cursor_id}",
+            })
+        if limit:
+            query = query.limit(limit)
+        # Timestamps come back as native datetimes; only documents written
+        # before they were stored natively still hold ISO strings. Firestore
+        # orders strings and timestamps as separate types, so until
+        # migrate_firestore.py backfills them those legacy conversations
+        # list above newer ones and past a timestamp cursor. Converting
+        # here keeps the response shape uniform meanwhile.
         conversations = []
-        for doc in docs:
+        async for doc in query.stream():
             data = doc.to_dict()
-            data["created_at"] = datetime.fromisoformat(data["created_at"])
-            data["updated_at"] = datetime.fromisoformat(data["updated_at"])
+            for field in ("created_at", "updated_at"):
+                if isinstance(data.get(field), str):
+                    data[field] = datetime.fromisoformat(data[field])
             conversations.append(data)
         return conversations
 
-    async def delete_conversation(self, user_id: str, conversation_id: str) -> None:
-        self._initialize()
-        self.db.collection("conversations").document(f"{user_id}_{conversation_id}").delete()
-        messages_query = self.db.collection("chat_messages").where("user_id", "==", user_id).where("conversation_id", "==", conversation_id)
+    @staticmethod
+    def _message_id_ranges(prefix: str, conversation: Dict[str, Any]) -> List[Tuple[str, str]]:
+        """
+        Split a conversation's message key range into contiguous ID ranges.
+
+        Message IDs are "msg_" + a ULID, whose first 10 characters encode
+        the creation time, so slicing [created_at, updated_at] into equal
+        time spans gives disjoint key ranges that can be scanned in parallel. The outer
+        ranges stay open-ended, so IDs outside the span are still covered.
+        Small or undated conversations get a single range.
+        """
+        whole = [(prefix, prefix + "\uf8ff")]
+        if (conversation.get("message_count") or 0) <= PARTITIONED_DELETE_THRESHOLD:
+            return whole
+        first, last = conversation.get("created_at"), conversation.get("updated_at")
+        if not isinstance(first, datetime) or not isinstance(last, datetime) or last <= first:
+            return whole
+
+        step = (last - first) / DELETE_PARTITIONS
+        bounds = [f"{prefix}msg_{str(ULID.from_datetime(first + step * i))[:10]}"
+                  for i in range(1, DELETE_PARTITIONS)]
+        starts = [prefix] + bounds
+        ends = bounds + [prefix + "\uf8ff"]
+        return list(zip(starts, ends))
+
+    async def _commit_delete_batch(self, batch, limiter: asyncio.Semaphore, commits: List[asyncio.Future]) -> None:
+        """Start a delete batch commit once one of the limiter's slots is free."""
+        await limiter.acquire()
+        commit = asyncio.ensure_future(batch.commit(retry=_DELETE_RETRY, timeout=_WRITE_TIMEOUT))
+        commit.add_done_callback(lambda _: limiter.release())
+        commits.append(commit)
+
+    async def _delete_message_range(self, start_id: str, end_id: str, limiter: asyncio.Semaphore, commits: List[asyncio.Future]) -> None:
+        """Stream one ID range and commit a delete batch every DELETE_BATCH_SIZE docs."""
         batch = self.db.batch()
         count = 0
-        for doc in messages_query.stream():
+        async for doc in self._chat_messages_range(start_id, end_id).select([]).stream():
             batch.delete(doc.reference)
             count += 1
-            if count >= 500:
-                batch.commit()
+            if count >= DELETE_BATCH_SIZE:
+                await self._commit_delete_batch(batch, limiter, commits)
                 batch = self.db.batch()
                 count = 0
-        if count > 0: batch.commit()
+        if count > 0:
+            await self._commit_delete_batch(batch, limiter, commits)
+
+    async def delete_conversation(self, user_id: str, conversation_id: str) -> None:
+        """
+        Delete a conversation document and all of its messages.
+
+        Message IDs are streamed with an empty field mask (no bodies are
+        transferred) and each DELETE_BATCH_SIZE-delete batch is committed as
+        soon as it fills, concurrently with the rest of the scan and with
+        up to DELETE_MAX_COMMITS other batches. Conversations with
+        more than PARTITIONED_DELETE_THRESHOLD messages are scanned as
+        DELETE_PARTITIONS parallel ID ranges instead of one cursor. The
+        conversation doc goes last, once every message delete has landed;
+        if a scan or commit fails, the remaining commits still finish before
+        the first error is raised and the conversation doc is kept.
+        """
+        self._initialize()
+        conv_ref = self._conv_col.document(f"{user_id}_{conversation_id}")
+        conv_doc = await conv_ref.get(field_paths=["created_at", "updated_at", "message_count"])
+        ranges = self._message_id_ranges(
+            f"{user_id}_{conversation_id}_", conv_doc.to_dict() or {}
+        )
+
+        limiter = asyncio.Semaphore(DELETE_MAX_COMMITS)
+        commits: List[asyncio.Future] = []
+        try:
+            scans = await asyncio.gather(*(
+                self._delete_message_range(start_id, end_id, limiter, commits)
+                for start_id, end_id in ranges
+            ), return_exceptions=True)
+        finally:
+            # Every started commit is awaited, even if a scan failed, so
+            # none is left running (or failing) unobserved
+            committed = await asyncio.gather(*commits, return_exceptions=True)
+        errors = [r for r in (*scans, *committed) if isinstance(r, BaseException)]
+        if errors:
+            raise errors[0]
+        await conv_ref.delete(retry=_DELETE_RETRY, timeout=_WRITE_TIMEOUT)
 
     # ================================================================================
     # USER OPERATIONS
     # ================================================================================
 
-    async def get_user(self, user_id: str) -> Optional[Any]:
-        """Retrieve user details and return as a User object."""
+    @staticmethod
+    def _user_redis_key(user_id: str) -> str:
+        return f"user:{user_id}"
+
+    async def invalidate_user(self, user_id: str) -> None:
+        """
+        Drop a user from the local and shared (Redis) read caches.
+
+        Redis gets a short-lived tombstone rather than a delete: read fills
+        use SET NX, so a read that started before this write (on any
+        instance) cannot put its stale copy back while the tombstone lives.
+        """
+        self._user_generation += 1
+        self._user_cache.pop(user_id, None)
+        await redis_service.set(self._user_redis_key(user_id), _USER_TOMBSTONE, settings.redis_user_tombstone_ttl)
+
+    @staticmethod
+    def _user_from_dict(data: Dict[str, Any]) -> Any:
+        from app.models import User
+
+        # Dates come back as Timestamps; model_validate also parses the ISO
+        # strings older user documents were written with
+        return User.model_validate(data)
+
+    async def _cache_user(self, user: Any, read_generation: Optional[int] = None) -> None:
+        """
+        Store a User in the local and shared (Redis) read caches.
+
+        Pass read_generation (_user_generation taken before the Firestore
+        read) when caching a read: the local copy is skipped if a user was
+        invalidated meanwhile, and Redis is only filled if the key is empty
+        (no tombstone from a newer write). Without it the user is written
+        through unconditionally.
+        """
+        is_fill = read_generation is not None
+        if settings.user_cache_ttl > 0 and (not is_fill or read_generation == self._user_generation):
+            self._user_cache[user.uid] = user
+        await redis_service.set(
+            self._user_redis_key(user.uid), user.model_dump_json(), settings.redis_user_ttl,
+            only_if_absent=is_fill,
+        )
+
+    async def get_user(self, user_id: str, source: str = "cache") -> Optional[Any]:
+        """
+        Retrieve user details and return as a User object.
+
+        Args:
+            user_id: User to load
+            source: "cache" (default) checks the process-local TTL cache,
+                then Redis (if configured), then Firestore. "server" skips
+                the caches and reads Firestore directly — use it where a
+                stale copy matters (login/registration). Either way a
+                Firestore hit refreshes the local cache and fills Redis
+                unless it already holds the user (or a tombstone).
+        """
+        # Import here to avoid circular dependencies
+        from app.models import User
+
+        if source not in ("cache", "server"):
+            raise ValueError(f"Invalid source: {source}")
+
+        if source == "cache":
+            cached = self._user_cache.get(user_id)
+            if cached is not None:
+                return cached
+
+            raw = await redis_service.get(self._user_redis_key(user_id))
+            if raw is not None and raw != _USER_TOMBSTONE:
+                user = User.model_validate_json(raw)
+                if settings.user_cache_ttl > 0:
+                    self._user_cache[user_id] = user
+                return user
+
         self._initialize()
-        doc = self.db.collection("users").document(user_id).get()
+        generation = self._user_generation
+        doc = await self._users_col.document(user_id).get()
         if not doc.exists:
+            await self.invalidate_user(user_id)
             return None
         
-        data = doc.to_dict()
-        
-        # Import here to avoid circular dependencies
+        user = self._user_from_dict(doc.to_dict())
+        await self._cache_user(user, read_generation=generation)
+        return user
+
+    async def get_users(self, user_ids: List[str]) -> Dict[str, Optional[Any]]:
+        """
+        Load several users at once, returning {uid: User or None}.
+
+        Cache tiers are checked as in get_user; all remaining uids are
+        fetched from Firestore with a single get_all() round trip.
+        """
         from app.models import User
-        
-        # Handle cases where Firestore dates were stored as strings
-        if isinstance(data.get("created_at"), str):
-            data["created_at"] = datetime.fromisoformat(data["created_at"])
-        if isinstance(data.get("last_login"), str):
-            data["last_login"] = datetime.fromisoformat(data["last_login"])
-            
-        return User(**data)
+
+        found: Dict[str, Optional[Any]] = {}
+        misses = []
+        for user_id in dict.fromkeys(user_ids):
+            cached = self._user_cache.get(user_id)
+            if cached is not None:
+                found[user_id] = cached
+            else:
+                misses.append(user_id)
+
+        if misses and redis_service.enabled:
+            raws = await asyncio.gather(*(redis_service.get(self._user_redis_key(uid)) for uid in misses))
+            still_missing = []
+            for user_id, raw in zip(misses, raws):
+                if raw is None or raw == _USER_TOMBSTONE:
+                    still_missing.append(user_id)
+                    continue
+                user = User.model_validate_json(raw)
+                if settings.user_cache_ttl > 0:
+                    self._user_cache[user_id] = user
+                found[user_id] = user
+            misses = still_missing
+
+        if misses:
+            self._initialize()
+            generation = self._user_generation
+            async for doc in self.db.get_all([self._users_col.document(uid) for uid in misses]):
+                if doc.exists:
+                    user = self._user_from_dict(doc.to_dict())
+                    await self._cache_user(user, read_generation=generation)
+                    found[doc.id] = user
+            for user_id in misses:
+                found.setdefault(user_id, None)
+
+        return found
+
+    @staticmethod
+    def _user_to_payload(user: Any) -> Dict[str, Any]:
+        """
+        Firestore payload for a User: one pydantic-core pass. Dates stay
+        datetimes (stored as native Timestamps); None fields are left out
+        and read back as their defaults.
+        """
+        if hasattr(user, "model_dump"):
+            data = user.model_dump(exclude_none=True)
+            data["role"] = user.role.value
+            return data
+        return user
 
     async def create_user(self, user: Any) -> None:
         """Create a new user. Expects a User model object."""
         self._initialize()
-        # Convert User model to dict
-        user_data = user.dict() if hasattr(user, "dict") else user
+        user_data = self._user_to_payload(user)
         user_id = user_data.get("uid")
-        
-        # Ensure dates are stored in a consistent format
-        if isinstance(user_data.get("created_at"), datetime):
-            user_data["created_at"] = user_data["created_at"].isoformat()
-        if isinstance(user_data.get("last_login"), datetime):
-            user_data["last_login"] = user_data["last_login"].isoformat()
-            
-        self.db.collection("users").document(user_id).set(user_data)
 
-    async def update_user(self, user_id: str, data: Dict[str, Any]) -> None:
-        """Update existing user data."""
+        await self._users_col.document(user_id).set(user_data, retry=_WRITE_RETRY, timeout=_WRITE_TIMEOUT)
+        if self._user_count_cache is not None:
+            count, counted_at = self._user_count_cache
+            self._user_count_cache = (count + 1, counted_at)
+
+        # Write-through: the caller already holds the full document, so
+        # seed the caches instead of paying a read on the first request
+        if hasattr(user, "model_dump_json"):
+            await self._cache_user(user)
+        else:
+            await self.invalidate_user(user_id)
+
+    async def update_user(self, user_id: str, data: Dict[str, Any]) -> bool:
+        """
+        Update existing user data.
+
+        No existence pre-read: update() itself fails with NotFound when the
+        document is missing.
+
+        Returns:
+            False if the user does not exist, True otherwise
+        """
         self._initialize()
-        
-        # Convert any datetime objects to strings before updating
-        clean_data = {}
-        for k, v in data.items():
-            if isinstance(v, datetime):
-                clean_data[k] = v.isoformat()
-            else:
-                clean_data[k] = v
-                
-        self.db.collection("users").document(user_id).update(clean_data)
+        try:
+            await self._users_col.document(user_id).update(data, retry=_WRITE_RETRY, timeout=_WRITE_TIMEOUT)
+        except NotFound:
+            return False
+        finally:
+            await self.invalidate_user(user_id)
+        return True
 
-    async def add_device_to_user(self, user_id: str, device_id: str) -> None:
-        """Add a device ID to the user's list of devices."""
+    async def batch_update_user(self, user_id: str, updates: List[Tuple[str, Any]], add_devices: Optional[List[str]] = None) -> bool:
+        """
+        Apply several field writes to a user in one WriteBatch commit.
+
+        Args:
+            user_id: User to update
+            updates: (field, value) pairs, applied in order
+            add_devices: Device IDs to union into the user's devices list
+
+        Returns:
+            False if the user does not exist, True otherwise
+        """
         self._initialize()
-        self.db.collection("users").document(user_id).update({
-            "devices": firestore.ArrayUnion([device_id])
-        })
+        doc_ref = self._users_col.document(user_id)
+
+        writes = [{k: v} for k, v in updates]
+        if add_devices:
+            writes.append({"devices": firestore.ArrayUnion(list(add_devices))})
+        if not writes:
+            return True
+
+        # Firestore caps a batch at 500 writes
+        try:
+            for start in range(0, len(writes), 500):
+                batch = self.db.batch()
+                for write in writes[start:start + 500]:
+                    batch.update(doc_ref, write)
+                await batch.commit(retry=_WRITE_RETRY, timeout=_WRITE_TIMEOUT)
+        except NotFound:
+            return False
+        finally:
+            await self.invalidate_user(user_id)
+        return True
+
+    async def add_device_to_user(self, user_id: str, device_id: str) -> bool:
+        """
+        Add a device ID to the user's list of devices.
+
+        One atomic ArrayUnion update: no read, and concurrent logins from
+        different devices cannot overwrite each other's entries.
+
+        Returns:
+            False if the user does not exist, True otherwise
+        """
+        self._initialize()
+        try:
+            await self._users_col.document(user_id).update({
+                "devices": firestore.ArrayUnion([device_id])
+            }, retry=_WRITE_RETRY, timeout=_WRITE_TIMEOUT)
+        except NotFound:
+            return False
+        finally:
+            await self.invalidate_user(user_id)
+        return True
+
+    def _user_count_fresh(self) -> Optional[int]:
+        cached = self._user_count_cache
+        if cached is not None and time.monotonic() - cached[1] < settings.user_count_cache_ttl:
+            return cached[0]
+        return None
 
     async def count_users(self) -> int:
+        """
+        Number of registered users.
+
+        Served from memory for USER_COUNT_CACHE_TTL seconds; on expiry one
+        caller runs the COUNT aggregation while concurrent callers wait
+        for its result. create_user bumps the cached value, so this
+        instance's own registrations are always counted.
+        """
+        count = self._user_count_fresh()
+        if count is not None:
+            return count
+
+        async with self._user_count_lock:
+            count = self._user_count_fresh()
+            if count is not None:
+                return count
+
+            self._initialize()
+            result = await self._users_col.count().get()
+            count = result[0][0].value
+            if settings.user_count_cache_ttl > 0:
+                self._user_count_cache = (count, time.monotonic())
+            return count
+
+    # ================================================================================
+    # SESSION OPERATIONS
+    # ================================================================================
+
+    @staticmethod
+    def _session_from_dict(data: Dict[str, Any]) -> Any:
+        # Import here to avoid circular dependencies
+        from app.models import SessionData
+        return SessionData.model_validate(data)
+
+    def _cache_session(self, session: Any) -> None:
+        if settings.session_cache_ttl > 0:
+            self._session_cache[session.session_id] = session
+
+    async def create_session(self, session: Any) -> None:
+        """Create a new session. Expects a SessionData model object."""
+        self._initialize()
+        # Plain field dict: data is already a dict, and datetimes are stored
+        # as native timestamps, so a full model_dump pass is not needed
+        await self._sessions_col.document(session.session_id).set({
+            "session_id": session.session_id,
+            "user_id": session.user_id,
+            "device_id": session.device_id,
+            "data": session.data,
+            "created_at": session.created_at,
+            "updated_at": session.updated_at,
+            "expires_at": session.expires_at
+        }, retry=_WRITE_RETRY, timeout=_WRITE_TIMEOUT)
+        self._cache_session(session)
+
+    async def get_session(self, session_id: str) -> Optional[Any]:
+        """
+        Retrieve a session and return it as a SessionData object.
+
+        Served from the short-lived session cache when possible; concurrent
+        misses for the same session share one Firestore read.
+        """
+        cached = self._session_cache.get(session_id)
+        if cached is not None:
+            return cached
+
+        task = self._session_inflight.get(session_id)
+        if task is None:
+            task = asyncio.create_task(self._fetch_session(session_id))
+            self._session_inflight[session_id] = task
+            task.add_done_callback(lambda _: self._session_inflight.pop(session_id, None))
+
+        # shield: one cancelled request must not cancel the shared read
+        return await asyncio.shield(task)
+
+    async def _fetch_session(self, session_id: str) -> Optional[Any]:
+        self._initialize()
+        doc = await self._sessions_col.document(session_id).get()
+        if not doc.exists:
+            return None
+        session = self._session_from_dict(doc.to_dict())
+        self._cache_session(session)
+        return session
+
+    async def get_user_sessions(self, user_id: str) -> List[Any]:
+        """Retrieve every session owned by a user."""
+        self._initialize()
+        query = self._sessions_col.where("user_id", "==", user_id)
+        return [self._session_from_dict(doc.to_dict()) async for doc in query.stream()]
+
+    async def update_session_if_owner(self, session_id: str, user_id: str, data: Dict[str, Any]) -> Any:
+        """
+        Merge `data` into a session's payload, checking ownership in the same
+        transaction. The ownership check and the write are atomic: a
+        concurrent update to the session makes the commit retry against
+        fresh data, so a write never lands on a snapshot it was not
+        checked against.
+
+        Raises:
+            SessionNotFoundError: If the session does not exist
+            SessionAccessDeniedError: If the session belongs to another user
+        """
         self._initialize()
-        query = self.db.collection("users").count()
-        result = query.get()
-        return result[0][0].value
+        doc_ref = self._sessions_col.document(session_id)
+
+        @firestore.async_transactional
+        async def _update(transaction):
+            snapshot = await doc_ref.get(transaction=transaction)
+            if not snapshot.exists:
+                raise SessionNotFoundError(session_id)
+
+            session_data = snapshot.to_dict()
+            if session_data.get("user_id") != user_id:
+                raise SessionAccessDeniedError(session_id)
+
+            session_data["data"] = {**session_data.get("data", {}), **data}
+            session_data["updated_at"] = datetime.now(timezone.utc)
+            transaction.update(doc_ref, {
+                "data": session_data["data"],
+                "updated_at": session_data["updated_at"]
+            })
+            return session_data
+
+        session = self._session_from_dict(await _update(self.db.transaction()))
+        self._cache_session(session)
+        return session
+
+    async def delete_session_if_owner(self, session_id: str, user_id: str) -> None:
+        """
+        Delete a session after checking ownership inside one transaction.
+
+        Raises:
+            SessionNotFoundError: If the session does not exist
+            SessionAccessDeniedError: If the session belongs to another user
+        """
+        self._initialize()
+        doc_ref = self._sessions_col.document(session_id)
+
+        @firestore.async_transactional
+        async def _delete(transaction):
+            snapshot = await doc_ref.get(transaction=transaction)
+            if not snapshot.exists:
+                raise SessionNotFoundError(session_id)
+            if snapshot.get("user_id") != user_id:
+                raise SessionAccessDeniedError(session_id)
+            transaction.delete(doc_ref)
+
+        await _delete(self.db.transaction())
+        self._session_cache.pop(session_id, None)
+
+    # ================================================================================
+    # FUNCTION CALL OPERATIONS
+    # ================================================================================
+
+    async def log_function_call(self, function_name: str, parameters: Dict[str, Any], user_id: str, result: Dict[str, Any]) -> None:
+        """
+        Record one function call (and its outcome) in the user's history.
+
+        Written by a background task, so the caller does not wait on it;
+        flush() waits for any still in flight at shutdown. parameters and
+        result come from the client, so they are made Firestore-safe first.
+        """
+        self._initialize()
+        data = {
+            "function_name": function_name,
+            "parameters": _firestore_safe(parameters),
+            "user_id": user_id,
+            "result": _firestore_safe(result),
+            "timestamp": firestore.SERVER_TIMESTAMP
+        }
+        task = asyncio.create_task(self._write_function_log(data))
+        self._log_tasks.add(task)
+        task.add_done_callback(self._log_tasks.discard)
+
+    async def _write_function_log(self, data: Dict[str, Any]) -> None:
+        # The document ID is generated client-side, so retrying is idempotent
+        try:
+            await self._function_calls_col.document().set(data, retry=_WRITE_RETRY, timeout=_WRITE_TIMEOUT)
+        except Exception as e:
+            logger.error("Dropped function log for %s: %s", data["function_name"], e)
+
+    async def stream_user_function_history(self, user_id: str, limit: int = 50) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Yield a user's function calls, newest first, as they arrive.
+
+        Callers that stop iterating early never pull the rest of the page.
+        """
+        self._initialize()
+        query = (self._function_calls_col
+                 .where("user_id", "==", user_id)
+                 .order_by("timestamp", direction=firestore.Query.DESCENDING)
+                 .limit(limit))
+        async for doc in query.stream():
+            yield doc.to_dict()
+
+    async def get_user_function_history(self, user_id: str, limit: int = 50) -> List[Dict[str, Any]]:
+        """List a user's function calls, newest first."""
+        return [call async for call in self.stream_user_function_history(user_id, limit)]
 
 # Singleton instance
 firestore_service = FirestoreService()
@@ -2,15 +2,56 @@
 Function calling service for Eva.
 Provides a framework for registering and executing functions with various capabilities.
 """
-from typing import Dict, Callable, Any, Optional
-from datetime import datetime
+from typing import Dict, Callable, Any, Optional, Tuple
+from datetime import datetime, timezone
+import hashlib
+import operator
 import time
 import asyncio
 
+import orjson
+
 from app.models import FunctionCall, FunctionResponse
 from app.services.firestore_service import firestore_service
 
 
+# ================================================================================
+# BUILT-IN FUNCTIONS
+# ================================================================================
+# Defined once at import; the registry only references them.
+
+_CALC_OPS: Dict[str, Callable[[float, float], float]] = {
+    "add": operator.add,
+    "subtract": operator.sub,
+    "multiply": operator.mul,
+    "divide": operator.truediv,
+}
+
+
+def echo(message: str) -> Dict[str, str]:
+    """Echo back a message."""
+    return {"echo": message}
+
+
+def get_time() -> Dict[str, str]:
+    """Get current time."""
+    now = datetime.utcnow()
+    return {
+        "timestamp": now.isoformat(),
+        "formatted": now.strftime("%Y-%m-%d %H:%M:%S UTC")
+    }
+
+
+def calculate(operation: str, a: float, b: float) -> Dict[str, float]:
+    """Perform basic arithmetic operations."""
+    op = _CALC_OPS.get(operation)
+    if op is None:
+        raise ValueError(f"Unknown operation: {operation}")
+    if op is operator.truediv and b == 0:
+        raise ValueError("Division by zero")
+    return {"result": op(a, b)}
+
+
 class FunctionRegistry:
     """
     Registry for callable functions.
@@ -23,6 +64,12 @@ class FunctionRegistry:
         """Initialize the function registry."""
         self._functions: Dict[str, Callable] = {}
         self._function_metadata: Dict[str, Dict[str, Any]] = {}
+        # Whether each function is a coroutine function, checked once at
+        # registration (kept out of the metadata, which is served to clients)
+        self._is_async: Dict[str, bool] = {}
+        
+        # Serialized listing + ETag, rebuilt lazily after any registration
+        self._listing_cache: Optional[Tuple[bytes, str]] = None
         
         # Register built-in functions
         self._register_builtin_functions()
@@ -39,11 +86,13 @@ class FunctionRegistry:
             parameters_schema: JSON schema for function parameters
         """
         self._functions[name] = func
+        self._is_async[name] = asyncio.iscoroutinefunction(func)
         self._function_metadata[name] = {
             "description": description,
             "parameters_schema": parameters_schema or {},
-            "registered_at": datetime.utcnow()
+            "registered_at": datetime.now(timezone.utc)
         }
+        self._listing_cache = None
     
     def get_function(self, name: str) -> Optional[Callable]:
         """
@@ -66,6 +115,34 @@ class FunctionRegistry:
         """
         return self._function_metadata.copy()
     
+    def list_functions_json(self) -> Tuple[bytes, str]:
+        """
+        Get the function listing pre-serialized as JSON, with its ETag.
+        
+        The listing only changes when a function is registered, so it is
+        encoded once and reused until the next registration.
+        
+        The ETag hashes only each function's name, description and
+        parameter schema, not its per-process registered_at, so every
+        instance and restart of the same deploy yields the same tag. It is
+        weak because the bodies still differ in registered_at.
+        
+        Returns:
+            Tuple of (JSON bytes, weak ETag string)
+        """
+        if self._listing_cache is None:
+            body = orjson.dumps(self._function_metadata)
+            stable = orjson.dumps(
+                {
+                    name: {"description": meta["description"], "parameters_schema": meta["parameters_schema"]}
+                    for name, meta in self._function_metadata.items()
+                },
+                option=orjson.OPT_SORT_KEYS,
+            )
+            etag = f'W/"{hashlib.md5(stable).hexdigest()}"'
+            self._listing_cache = (body, etag)
+        return self._listing_cache
+    
     async def call(self, function_call: FunctionCall) -> FunctionResponse:
         """
         Execute a function call.
@@ -89,8 +166,7 @@ class FunctionRegistry:
         
         # Execute function
         try:
-            # Check if function is async
-            if asyncio.iscoroutinefunction(func):
+            if self._is_async[function_call.function_name]:
                 result = await func(**function_call.parameters)
             else:
                 result = func(**function_call.parameters)
@@ -132,10 +208,6 @@ class FunctionRegistry:
         """Register built-in functions that are always available."""
         
         # Example: Echo function
-        def echo(message: str) -> Dict[str, str]:
-            """Echo back a message."""
-            return {"echo": message}
-        
         self.register(
             name="echo",
             func=echo,
@@ -150,13 +222,6 @@ class FunctionRegistry:
         )
         
         # Example: Get current time
-        def get_time() -> Dict[str, str]:
-            """Get current time."""
-            return {
-                "timestamp": datetime.utcnow().isoformat(),
-                "formatted": datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S UTC")
-            }
-        
         self.register(
             name="get_time",
             func=get_time,
@@ -165,24 +230,6 @@ class FunctionRegistry:
         )
         
         # Example: Calculate function
-        def calculate(operation: str, a: float, b: float) -> Dict[str, float]:
-            """Perform basic arithmetic operations."""
-            operations = {
-                "add": lambda x, y: x + y,
-                "subtract": lambda x, y: x - y,
-                "multiply": lambda x, y: x * y,
-                "divide": lambda x, y: x / y if y != 0 else None
-            }
-            
-            if operation not in operations:
-                raise ValueError(f"Unknown operation: {operation}")
-            
-            result = operations[operation](a, b)
-            if result is None:
-                raise ValueError("Division by zero")
-            
-            return {"result": result}
-        
         self.register(
             name="calculate",
             func=calculate,
@@ -8,9 +8,37 @@ from google import genai
 from google.genai import types
 from typing import Optional, AsyncGenerator, Dict, Any, List
 from datetime import datetime
+from weakref import WeakValueDictionary
 import asyncio
+import hashlib
+
+import orjson
+from cachetools import LRUCache, TTLCache
 
 from app.config import settings
+from app.services.firestore_service import firestore_service
+
+
+# In-memory history bounds: at most MAX_CONVERSATIONS conversations are
+# kept (least recently used are dropped first), each holding at most
+# MAX_HISTORY_TURNS user/model exchanges. Firestore holds the full
+# history; a conversation that is not in memory (evicted, or served by
+# another instance) is reloaded from there on its next message.
+#
+# Histories are append-only: earlier turns are never edited or
+# reordered, so every request starts with the previous request's exact
+# contents and Gemini's implicit prefix cache can reuse it. When a
+# history is full, its oldest half is dropped in one go (rather than one
+# turn per message), so the prefix only changes every
+# MAX_HISTORY_TURNS / 2 exchanges.
+
+# Exact-match reply cache for send_message: an identical model, system
+# instruction, history and message within RESPONSE_CACHE_TTL seconds is
+# answered from memory (retries, repeated greetings in new chats).
+RESPONSE_CACHE_SIZE = 1024
+RESPONSE_CACHE_TTL = 300.0
+MAX_CONVERSATIONS = 10_000
+MAX_HISTORY_TURNS = 20
 
 
 # ==============================================================================
@@ -48,11 +76,9 @@ class GeminiService:
         if not settings.google_api_key:
             print("⚠️  WARNING: GOOGLE_API_KEY is not set.")
 
-        # Create the google-genai client
-        # Removed 'v1alpha' to use the stable v1 API for better reliability
-        self.client = genai.Client(
-            api_key=settings.google_api_key
-        )
+        # The google-genai client is created on first use (see _get_client)
+        # so importing this module stays cheap at startup
+        self._client: Optional[genai.Client] = None
 
         # Updated to the stable Gemini 2.0 Flash model ID
         self.model_id = "gemini-2.0-flash"
@@ -60,8 +86,35 @@ class GeminiService:
         # System instruction for EVA's personality
         self.system_instruction = EVA_SYSTEM_INSTRUCTION
 
-        # Store for conversation histories
-        self._conversation_histories: Dict[str, List[types.Content]] = {}
+        # Same config on every call, so build it once. For a per-request
+        # override, derive a copy with self._gen_config.model_copy(update=...)
+        self._gen_config = types.GenerateContentConfig(
+            system_instruction=self.system_instruction,
+        )
+
+        # Store for conversation histories (bounded, see MAX_CONVERSATIONS)
+        self._conversation_histories: "LRUCache[str, List[types.Content]]" = LRUCache(
+            maxsize=MAX_CONVERSATIONS
+        )
+
+        # One lock per conversation, held for a whole turn so concurrent
+        # messages to the same conversation append to its history in
+        # order. Weak values: a lock disappears once no turn holds it.
+        self._locks: "WeakValueDictionary[str, asyncio.Lock]" = WeakValueDictionary()
+
+        # Prompt hash -> reply text (see RESPONSE_CACHE_SIZE)
+        self._response_cache: "TTLCache[str, str]" = TTLCache(
+            maxsize=RESPONSE_CACHE_SIZE, ttl=RESPONSE_CACHE_TTL
+        )
+
+    def _get_client(self) -> genai.Client:
+        # No await in between, so concurrent requests cannot both build one
+        if self._client is None:
+            # Removed 'v1alpha' to use the stable v1 API for better reliability
+            self._client = genai.Client(
+                api_key=settings.google_api_key
+            )
+        return self._client
 
     # ==========================================================================
     # CONVERSATION HISTORY MANAGEMENT
@@ -70,98 +123,150 @@ class GeminiService:
     def _get_session_key(self, user_id: str, conversation_id: Optional[str] = None) -> str:
         return f"{user_id}:{conversation_id or 'default'}"
 
-    def _get_history(self, user_id: str, conversation_id: Optional[str] = None) -> List[types.Content]:
+    async def _load_history(self, user_id: str, conversation_id: Optional[str], new_conversation: bool) -> List[types.Content]:
+        """
+        Return the in-memory history, seeding it from Firestore on a miss.
+
+        Skips the read for the default conversation and for conversations
+        the caller has just created, which have no stored messages yet.
+        """
         key = self._get_session_key(user_id, conversation_id)
-        if key not in self._conversation_histories:
-            self._conversation_histories[key] = []
-        return self._conversation_histories[key]
-
-    def _append_to_history(self, user_id: str, conversation_id: Optional[str], role: str, text: str) -> None:
-        history = self._get_history(user_id, conversation_id)
-        history.append(
-            types.Content(
-                role=role,
-                parts=[types.Part.from_text(text=text)],
-            )
-        )
+        history = self._conversation_histories.get(key)
+        if history is not None:
+            return history
+
+        history = []
+        if conversation_id and not new_conversation:
+            try:
+                messages = await firestore_service.get_recent_chat_messages(
+                    user_id, conversation_id, MAX_HISTORY_TURNS * 2
+                )
+            except Exception as e:
+                print(f"⚠️  WARNING: Could not load history for {key}: {e}")
+                messages = []
+            for stored in messages:
+                history.append(self._content(
+                    "model" if stored.get("role") == "assistant" else "user",
+                    stored.get("content", ""),
+                ))
+
+        # A concurrent request may have seeded it while we were reading
+        return self._conversation_histories.setdefault(key, history)
+
+    def _get_lock(self, key: str) -> asyncio.Lock:
+        lock = self._locks.get(key)
+        if lock is None:
+            lock = asyncio.Lock()
+            self._locks[key] = lock
+        return lock
+
+    @staticmethod
+    def _content(role: str, text: str) -> types.Content:
+        return types.Content(role=role, parts=[types.Part.from_text(text=text)])
+
+    def _prompt_key(self, contents: List[types.Content]) -> str:
+        """Hash of everything that determines the reply to `contents`."""
+        payload = orjson.dumps([
+            self.model_id,
+            self.system_instruction,
+            [(c.role, [part.text for part in c.parts]) for c in contents],
+        ])
+        return hashlib.blake2b(payload, digest_size=16).hexdigest()
+
+    @staticmethod
+    def _begin_turn(history: List[types.Content], user_content: types.Content) -> None:
+        """Append the user's message in place, first dropping the oldest half if full."""
+        if len(history) >= MAX_HISTORY_TURNS * 2:
+            del history[:MAX_HISTORY_TURNS]
+        history.append(user_content)
+
+    @staticmethod
+    def _rollback_turn(history: List[types.Content], user_content: types.Content) -> None:
+        """Undo _begin_turn when no reply was recorded for the message."""
+        if history and history[-1] is user_content:
+            history.pop()
 
     # ==========================================================================
     # TEXT CHAT
     # ==========================================================================
 
-    async def send_message(self, message: str, user_id: str, conversation_id: Optional[str] = None) -> str:
-        try:
-            history = self._get_history(user_id, conversation_id)
-            user_content = types.Content(
-                role="user",
-                parts=[types.Part.from_text(text=message)],
-            )
-            contents = history + [user_content]
-
-            # Call Gemini
-            response = await asyncio.to_thread(
-                self.client.models.generate_content,
-                model=self.model_id,
-                contents=contents,
-                config=types.GenerateContentConfig(
-                    system_instruction=self.system_instruction,
-                ),
-            )
-
-            response_text = response.text
-
-            # Persist history
-            self._append_to_history(user_id, conversation_id, "user", message)
-            self._append_to_history(user_id, conversation_id, "model", response_text)
-
-            return response_text
-
-        except Exception as e:
-            print(f"Gemini API Error: {e}")
-            return "I'm sorry, I encountered an issue processing your request. Please try again."
+    async def send_message(self, message: str, user_id: str, conversation_id: Optional[str] = None, new_conversation: bool = False) -> str:
+        history: List[types.Content] = []
+        user_content = self._content("user", message)
+        async with self._get_lock(self._get_session_key(user_id, conversation_id)):
+            try:
+                history = await self._load_history(user_id, conversation_id, new_conversation)
+                self._begin_turn(history, user_content)
+
+                prompt_key = self._prompt_key(history)
+                response_text = self._response_cache.get(prompt_key)
+                if response_text is None:
+                    # Call Gemini (native async client: no worker thread per call)
+                    response = await self._get_client().aio.models.generate_content(
+                        model=self.model_id,
+                        contents=history,
+                        config=self._gen_config,
+                    )
+                    response_text = response.text
+                    if response_text:
+                        self._response_cache[prompt_key] = response_text
+
+                history.append(self._content("model", response_text))
+                return response_text
+
+            except Exception as e:
+                self._rollback_turn(history, user_content)
+                print(f"Gemini API Error: {e}")
+                return "I'm sorry, I encountered an issue processing your request. Please try again."
 
     # ==========================================================================
     # STREAMING CHAT
     # ==========================================================================
 
-    async def send_message_stream(self, message: str, user_id: str, conversation_id: Optional[str] = None) -> AsyncGenerator[str, None]:
+    async def send_message_stream(self, message: str, user_id: str, conversation_id: Optional[str] = None, new_conversation: bool = False) -> AsyncGenerator[str, None]:
+        """
+        Stream the reply to `message` chunk by chunk.
+
+        The conversation lock is only held while the history is loaded and
+        snapshotted, never across a yield: a client that disconnects
+        mid-stream must not block later turns until the generator is
+        finalized. The turn is recorded only once the reply is complete.
+        """
+        user_content = self._content("user", message)
         try:
-            history = self._get_history(user_id, conversation_id)
-            user_content = types.Content(
-                role="user",
-                parts=[types.Part.from_text(text=message)],
-            )
-            contents = history + [user_content]
+            async with self._get_lock(self._get_session_key(user_id, conversation_id)):
+                history = await self._load_history(user_id, conversation_id, new_conversation)
+                contents = list(history)
+            self._begin_turn(contents, user_content)
 
-            response_stream = self.client.models.generate_content_stream(
+            response_stream = await self._get_client().aio.models.generate_content_stream(
                 model=self.model_id,
                 contents=contents,
-                config=types.GenerateContentConfig(
-                    system_instruction=self.system_instruction,
-                ),
+                config=self._gen_config,
             )
 
             full_response = ""
-            for chunk in response_stream:
+            async for chunk in response_stream:
                 if chunk.text:
                     full_response += chunk.text
                     yield chunk.text
 
-            self._append_to_history(user_id, conversation_id, "user", message)
-            self._append_to_history(user_id, conversation_id, "model", full_response)
-
         except Exception as e:
             print(f"Gemini Streaming Error: {e}")
             yield "I'm sorry, I encountered an issue. Please try again."
+            return
+
+        # No await between these, so the pair lands atomically with respect
+        # to other turns without retaking the lock
+        self._begin_turn(history, user_content)
+        history.append(self._content("model", full_response))
 
     # ==========================================================================
     # CONVERSATION MANAGEMENT
     # ==========================================================================
 
     def clear_conversation(self, user_id: str, conversation_id: Optional[str] = None) -> None:
-        key = self._get_session_key(user_id, conversation_id)
-        if key in self._conversation_histories:
-            del self._conversation_histories[key]
+        self._conversation_histories.pop(self._get_session_key(user_id, conversation_id), None)
 
 # Singleton instance
 gemini_service = GeminiService()
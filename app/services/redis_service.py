@@ -0,0 +1,95 @@
+"""
+================================================================================
+REDIS CACHE SERVICE FOR EVA BACKEND
+================================================================================
+
+PURPOSE:
+    Optional shared cache that sits between the in-process caches and
+    Firestore. Unlike process memory, Redis is shared by every Cloud Run
+    instance, so a user document loaded by one instance is a cache hit
+    for all the others.
+
+ENABLING:
+    Set REDIS_URL (e.g. redis://10.0.0.3:6379/0). When it is empty, or the
+    `redis` package is not installed, every call is a cheap no-op and
+    callers fall through to Firestore.
+
+FAILURE MODE:
+    Redis is only a cache. Connection errors are logged and treated as a
+    miss — they never fail the request.
+
+================================================================================
+"""
+
+from typing import Optional, Union
+
+from app.config import settings
+
+try:
+    import redis.asyncio as aioredis
+except ImportError:  # pragma: no cover - optional dependency
+    aioredis = None
+
+
+class RedisService:
+    """
+    Thin async wrapper around a single shared Redis client.
+    """
+
+    def __init__(self):
+        self.client = None
+        self._initialized = False
+
+    def _initialize(self):
+        if self._initialized:
+            return
+        self._initialized = True
+
+        if not settings.redis_url:
+            return
+
+        if aioredis is None:
+            print(
+                "⚠️  WARNING: REDIS_URL is set but the 'redis' package is not "
+                "installed. Redis cache disabled."
+            )
+            return
+
+        self.client = aioredis.from_url(settings.redis_url)
+
+    @property
+    def enabled(self) -> bool:
+        self._initialize()
+        return self.client is not None
+
+    async def get(self, key: str) -> Optional[bytes]:
+        """Return the cached value, or None on miss / error / disabled."""
+        if not self.enabled:
+            return None
+        try:
+            return await self.client.get(key)
+        except Exception as e:
+            print(f"Redis GET failed for {key}: {e}")
+            return None
+
+    async def set(self, key: str, value: Union[str, bytes], ttl: int, only_if_absent: bool = False) -> None:
+        """Store a value with an expiry in seconds (SET NX if only_if_absent)."""
+        if not self.enabled:
+            return
+        try:
+            await self.client.set(key, value, ex=ttl, nx=only_if_absent)
+        except Exception as e:
+            print(f"Redis SET failed for {key}: {e}")
+
+    async def delete(self, key: str) -> None:
+        """Remove a key."""
+        if not self.enabled:
+            return
+        try:
+            await self.client.delete(key)
+        except Exception as e:
+            print(f"Redis DELETE failed for {key}: {e}")
+
+
+# Singleton instance
+redis_service = RedisService()
@@ -32,7 +32,7 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(s
             return {"user": user.email}
     """
     token = credentials.credentials
-    user = await auth_service.get_current_user(token)
+    user = await auth_service.resolve_user_from_bearer(token)
     
     if not user:
         raise HTTPException(
@@ -40,14 +40,15 @@ ROUTE ARCHITECTURE:
 ================================================================================
 """
 
-from fastapi import FastAPI, HTTPException
+from fastapi import Depends, FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import ORJSONResponse
 from contextlib import asynccontextmanager
 
-from app.config import settings
+from app.config import Settings, get_settings, settings
 from app.api import auth, users, sessions, functions
 from app.api import chat
+from app.services.firestore_service import firestore_service
 
 
 # ================================================================================
@@ -65,6 +66,7 @@ async def lifespan(app: FastAPI):
 
     STARTUP:
         Prints configuration information for debugging
+        Warms up the shared Firestore client (channel + auth token)
 
     SHUTDOWN:
         Prints shutdown message
@@ -81,11 +83,25 @@ async def lifespan(app: FastAPI):
     print(f"Chat Endpoint: Enabled ✓")
     print("=" * 60)
 
+    # Open the Firestore channel now instead of on the first request.
+    # A failure here is logged, not fatal — requests will retry lazily.
+    try:
+        await firestore_service.warmup()
+        print("Firestore: Connected ✓")
+    except Exception as e:
+        print(f"⚠️  WARNING: Firestore warmup failed: {e}")
+
     yield  # Server runs here
 
     # ===== SHUTDOWN =====
     print("\n🤖 EVA Backend Shutting Down...")
 
+    # Commit chat writes and function logs still waiting to be written
+    try:
+        await firestore_service.flush()
+    except Exception as e:
+        print(f"⚠️  WARNING: Firestore flush failed: {e}")
+
 
 # ================================================================================
 # FASTAPI APPLICATION
@@ -100,6 +116,8 @@ app = FastAPI(
     ),
     version="0.1.0",
     lifespan=lifespan,
+    # orjson (C extension) encodes every JSON response much faster than stdlib json
+    default_response_class=ORJSONResponse,
 )
 
 
@@ -186,7 +204,7 @@ async def root():
 
 
 @app.get("/health")
-async def health_check():
+async def health_check(app_settings: Settings = Depends(get_settings)):
     """
     Root-level health check — used by Cloud Run, load balancers,
     and monitoring systems that probe the bare /health path.
@@ -200,8 +218,8 @@ async def health_check():
     """
     return {
         "status": "healthy",
-        "environment": settings.environment,
-        "max_users": settings.max_users,
+        "environment": app_settings.environment,
+        "max_users": app_settings.max_users,
     }
 
 
@@ -214,7 +232,7 @@ async def health_check():
 # ================================================================================
 
 @app.get("/api/health")
-async def api_health_check():
+async def api_health_check(app_settings: Settings = Depends(get_settings)):
     """
     API-level health check — used by the Android app.
 
@@ -226,8 +244,8 @@ async def api_health_check():
     """
     return {
         "status": "healthy",
-        "environment": settings.environment,
-        "max_users": settings.max_users,
+        "environment": app_settings.environment,
+        "max_users": app_settings.max_users,
     }
 
 
@@ -250,7 +268,7 @@ async def global_exception_handler(request, exc):
     """
     print(f"Unhandled exception: {exc}")
 
-    return JSONResponse(
+    return ORJSONResponse(
         status_code=500,
         content={
             "detail": "Internal server error",
@@ -275,6 +293,15 @@ if __name__ == "__main__":
         "main:app",
         host="0.0.0.0",   # MUST be 0.0.0.0 for Cloud Run
         port=current_port,
-        reload=False      # Must be False in production
+        reload=False,     # Must be False in production
+        # "auto" picks uvloop + httptools (from uvicorn[standard]) where
+        # they are available and falls back to asyncio / h11 elsewhere
+        # (uvloop does not support Windows)
+        loop="auto",
+        http="auto",
+        # Chat history and caches live in process memory, so keep one
+        # worker per instance unless API_WORKERS is raised deliberately
+        workers=settings.api_workers,
+        limit_concurrency=settings.api_limit_concurrency,
+        timeout_keep_alive=30,
     )
-
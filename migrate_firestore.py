@@ -0,0 +1,171 @@
+"""
+One-off Firestore data migration for Eva backend.
+
+Rewrites documents written by earlier versions into the current layout:
+1. Chat messages with random 'msg_<hex>' IDs are re-keyed to
+   time-sortable 'msg_<ULID>' IDs built from their stored timestamp.
+   Messages are read in document-ID order, so until this runs, older
+   conversations come back out of order (legacy IDs even sort after
+   every new message).
+2. Conversation created_at/updated_at values stored as ISO strings are
+   rewritten as native timestamps. Firestore orders strings and
+   timestamps as separate types, so until this runs, legacy
+   conversations list above every new one and a timestamp page cursor
+   never reaches them.
+
+Safe to re-run: documents already in the current format are skipped.
+
+Usage:
+    python migrate_firestore.py             # apply the migration
+    python migrate_firestore.py --dry-run   # only report what would change
+"""
+import asyncio
+import os
+import re
+import sys
+from datetime import datetime, timezone
+from typing import Any, Optional
+
+# Make the app package importable when run from anywhere
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from ulid import ULID
+
+from app.services.firestore_service import firestore_service
+
+
+# "msg_" + a 26-character Crockford base32 ULID (the current format)
+ULID_MESSAGE_ID = re.compile(r"^msg_[0-9A-HJKMNP-TV-Z]{26}$")
+
+# Documents read per page, and writes per batch commit (Firestore caps a
+# commit at 500)
+PAGE_SIZE = 500
+BATCH_OPS = 400
+
+
+def _parse_timestamp(value: Any) -> Optional[datetime]:
+    """Stored timestamp as an aware datetime (legacy values are naive UTC ISO strings)."""
+    if isinstance(value, str):
+        try:
+            value = datetime.fromisoformat(value.replace("Z", "+00:00"))
+        except ValueError:
+            return None
+    if not isinstance(value, datetime):
+        return None
+    return value if value.tzinfo else value.replace(tzinfo=timezone.utc)
+
+
+async def migrate_message_ids(dry_run: bool) -> int:
+    """Re-key legacy chat messages to ULID IDs. Returns how many were (or would be) moved."""
+    firestore_service._initialize()
+    collection = firestore_service._chat_col
+
+    migrated = 0
+    batch = firestore_service.db.batch()
+    ops = 0
+    last_doc = None
+
+    while True:
+        query = collection.order_by("__name__").limit(PAGE_SIZE)
+        if last_doc is not None:
+            query = query.start_after(last_doc)
+        docs = [doc async for doc in query.stream()]
+        if not docs:
+            break
+        last_doc = docs[-1]
+
+        for doc in docs:
+            prefix, sep, message_part = doc.id.rpartition("_msg_")
+            if not sep or ULID_MESSAGE_ID.match("msg_" + message_part):
+                continue
+
+            data = doc.to_dict()
+            timestamp = _parse_timestamp(data.get("timestamp"))
+            if timestamp is None:
+                print(f"  ⚠️  Skipping {doc.id}: no usable timestamp")
+                continue
+
+            new_ref = collection.document(f"{prefix}_msg_{ULID.from_datetime(timestamp)}")
+            migrated += 1
+            if dry_run:
+                continue
+
+            batch.set(new_ref, firestore_service._chat_message_payload(
+                data.get("content", ""), data.get("role", "user"), timestamp
+            ))
+            batch.delete(doc.reference)
+            ops += 2
+            if ops >= BATCH_OPS:
+                await batch.commit()
+                batch = firestore_service.db.batch()
+                ops = 0
+
+    if ops:
+        await batch.commit()
+    return migrated
+
+
+async def migrate_conversation_dates(dry_run: bool) -> int:
+    """Convert legacy string conversation dates to timestamps. Returns how many conversations were (or would be) updated."""
+    firestore_service._initialize()
+    collection = firestore_service._conv_col
+
+    migrated = 0
+    batch = firestore_service.db.batch()
+    ops = 0
+    last_doc = None
+
+    while True:
+        query = collection.order_by("__name__").limit(PAGE_SIZE)
+        if last_doc is not None:
+            query = query.start_after(last_doc)
+        docs = [doc async for doc in query.stream()]
+        if not docs:
+            break
+        last_doc = docs[-1]
+
+        for doc in docs:
+            data = doc.to_dict()
+            updates = {}
+            for field in ("created_at", "updated_at"):
+                if isinstance(data.get(field), str):
+                    timestamp = _parse_timestamp(data[field])
+                    if timestamp is None:
+                        print(f"  ⚠️  Skipping {doc.id}.{field}: unparseable value {data[field]!r}")
+                        continue
+                    updates[field] = timestamp
+            if not updates:
+                continue
+
+            migrated += 1
+            if dry_run:
+                continue
+
+            batch.update(doc.reference, updates)
+            ops += 1
+            if ops >= BATCH_OPS:
+                await batch.commit()
+                batch = firestore_service.db.batch()
+                ops = 0
+
+    if ops:
+        await batch.commit()
+    return migrated
+
+
+async def main(dry_run: bool) -> None:
+    print("=" * 60)
+    print("EVA Firestore migration" + (" (dry run)" if dry_run else ""))
+    print("=" * 60)
+
+    print("Re-keying legacy chat message IDs...")
+    count = await migrate_message_ids(dry_run)
+    print(f"  ✓ {count} message(s) {'to migrate' if dry_run else 'migrated'}")
+
+    print("Converting legacy conversation dates to timestamps...")
+    count = await migrate_conversation_dates(dry_run)
+    print(f"  ✓ {count} conversation(s) {'to migrate' if dry_run else 'migrated'}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main(dry_run="--dry-run" in sys.argv[1:]))
@@ -0,0 +1,29 @@
+"""
+Message ID ordering: chat history is read in document-ID order, so a
+reply's ID must sort after the ID of the message it answers.
+
+Run with: python -m unittest discover tests
+"""
+import unittest
+from datetime import datetime, timezone
+
+from app.api.chat import _message_id, _reply_timestamp
+
+
+class ReplyOrderTest(unittest.TestCase):
+    def test_reply_in_same_millisecond_sorts_after_prompt(self):
+        timestamp = datetime(2025, 1, 1, 12, 0, 0, 500, tzinfo=timezone.utc)
+        # The low ULID bits are random; repeat so a lucky draw can't pass
+        for _ in range(200):
+            user_id = _message_id(timestamp)
+            reply_id = _message_id(_reply_timestamp(timestamp, timestamp))
+            self.assertLess(user_id, reply_id)
+
+    def test_later_reply_keeps_its_own_timestamp(self):
+        user_ts = datetime(2025, 1, 1, 12, 0, 0, tzinfo=timezone.utc)
+        response_ts = datetime(2025, 1, 1, 12, 0, 3, tzinfo=timezone.utc)
+        self.assertEqual(_reply_timestamp(user_ts, response_ts), response_ts)
+
+
+if __name__ == "__main__":
+    unittest.main()